@@ -270,7 +270,15 @@ class Biography(object, BioDesDoc):
             self._person = self.repository.get_person(bioport_id=bioport_id)
         return self._person
 
-    def save(self, user, comment=''):
+    def save(self, user, comment='', update_person=True):
+        """save a new version of this biography
+
+        arguments:
+            user: the name of the user that made the change
+            comment: a comment that describes the change
+            update_person: if False, the person of the biography is not saved
+                (when we change many biographies of the same person, we save the person once, afterwards)
+        """
         db = self.repository.db
         self.create_id()
         with db.get_session_context() as session:
@@ -298,21 +306,9 @@ class Biography(object, BioDesDoc):
             # (note that this changes the XML in the biography object)
             db._register_biography(self)
 
-            # get all biographies with this id, and increment their version number with one
-            ls = db._get_biography_query(
-                local_id=self.id,
-                order_by='version',
-                )
-            ls = enumerate(ls)
-            ls = list(ls)
-            ls.reverse()
-            for i, r_bio in ls:
-                r_bio.version = i + 1
-                session.object_session(r_bio).flush()
-
-            # for some reason sqlalchemy does not always write changes to db
-            # (and we get an integreity error because id-version is not unique)
-            # TODO: fix bug described in lines above in a more elegant way
+            # increment the version number of all biographies with this id with one
+            session.flush()
+            db._bump_versions(session, self.id)
 
             # create a new version
             self._record = r_biography = BiographyRecord(id=self.get_id())
@@ -333,7 +329,8 @@ class Biography(object, BioDesDoc):
         #  (or add a person if the biography is new)
         person = self.get_person()
 
-        person.save()
+        if update_person:
+            person.save()
         msg = 'saved biography with id %s' % (self.id)
         if comment:
             msg += '; %s' % comment
@@ -19,6 +19,8 @@
 ##########################################################################
 
 import datetime
+import threading
+from collections import OrderedDict
 
 
 class BioPortException(Exception):
@@ -70,3 +72,57 @@ def format_date(d):
     (use this because strftime does not like dates before 1900)"""
     if d:
         return u"%04d-%02d-%02d %02d:%02d" % (d.year, d.month, d.day, d.hour, d.minute)
+
+
+class LRUCache(object):
+    """A dictionary-like cache that holds at most maxsize items
+
+    When the cache is full, the least recently used item is thrown away.
+    The cache keeps count of hits and misses, and is safe to use from different threads.
+    """
+
+    def __init__(self, maxsize=1000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            # re-insert the value, so it becomes the most recently used one
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def remove(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def items(self):
+        with self._lock:
+            return self._data.items()
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
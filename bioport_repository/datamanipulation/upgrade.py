@@ -24,6 +24,43 @@
 june21_2012 = """
 ALTER TABLE `biography` ADD INDEX `ix_source_version`(`source_id`, `version`);
 
+"""
+
+# the browse index (DBRepository.USE_BROWSE_INDEX); fill it with DBRepository.rebuild_browse_index
+october2026_person_browse = """
+CREATE TABLE `person_browse` (
+  `initial` varchar(1) NOT NULL,
+  `category_id` int(11) NOT NULL,
+  `sort_key` varchar(50) NOT NULL,
+  `bioport_id` int(11) NOT NULL,
+  PRIMARY KEY (`initial`, `category_id`, `sort_key`, `bioport_id`),
+  KEY `ix_person_browse_bioport_id` (`bioport_id`),
+  FOREIGN KEY (`bioport_id`) REFERENCES `person` (`bioport_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+
+"""
+
+# the decade index (DBRepository.USE_DECADE_INDEX); fill it with DBRepository.rebuild_decade_index
+october2026_person_decade = """
+CREATE TABLE `person_decade` (
+  `bioport_id` int(11) NOT NULL,
+  `decade` int(11) NOT NULL,
+  PRIMARY KEY (`bioport_id`, `decade`),
+  KEY `ix_person_decade_decade` (`decade`),
+  FOREIGN KEY (`bioport_id`) REFERENCES `person` (`bioport_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+
+"""
+
+# the clusters of identified persons (DBRepository.USE_PERSON_CLUSTERS); fill it with DBRepository.rebuild_person_clusters
+october2026_person_cluster = """
+CREATE TABLE `person_cluster` (
+  `bioport_id` int(11) NOT NULL,
+  `canonical_id` int(11) NOT NULL,
+  PRIMARY KEY (`bioport_id`),
+  KEY `ix_person_cluster_canonical_id` (`canonical_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+
 """
 def upgrade_march2012():
     sql = """ALTER TABLE `person` MODIFY COLUMN `geboortedatum` CHAR(12)  DEFAULT NULL,
@@ -23,9 +23,10 @@ from __future__ import with_statement
 import random
 import os
 import types
-import re
 import logging
 import contextlib
+import multiprocessing
+from array import array
 from datetime import datetime
 import time
 import transaction
@@ -41,7 +42,7 @@ from sqlalchemy.exc import ResourceClosedError
 from zope.sqlalchemy import ZopeTransactionExtension
 from plone.memoize import instance
 
-from names.similarity import soundexes_nl
+from bioport_repository.soundex import soundexes_nl
 from names.common import TUSSENVOEGSELS, words
 from names.name import TYPE_FAMILYNAME, TYPE_INTRAPOSITON, TYPE_TERRITORIAL
 
@@ -56,6 +57,9 @@ from bioport_repository.db_definitions import (
     DeferIdentificationRecord,
     Location,
     Comment,
+    PersonBrowse,
+    PersonCluster,
+    PersonDecade,
     PersonSource,
     PersonSoundex,
 #    PersonView,
@@ -75,20 +79,67 @@ from bioport_repository.similarity.similarity import Similarity
 from bioport_repository.person import Person
 from bioport_repository.biography import Biography
 from bioport_repository.source import Source
-from bioport_repository.common import format_date, to_date, BioPortException, BioPortNotFoundError
+from bioport_repository.common import format_date, to_date, BioPortException, BioPortNotFoundError, LRUCache
 from bioport_repository.versioning import Version
 from bioport_repository.merged_biography import BiographyMerger
+from bioport_repository.name_index import NameIndex
+from bioport_repository.sampler import IdSampler
+from bioport_repository.fulltext import get_fulltext_index
 
 LENGTH = 8  # the length of a bioport id
+
 # ECHO = True  # log all mysql queries.
 ECHO = False  # dont' log all mysql queries.
 EXCLUDE_THIS_STATUS_FROM_SIMILARITY = [5, 9]  # if persons have this status, we will not include them in the similarity cache
 
 
+def _pack_ids(ls):
+    """return the list of bioport ids ls (which are integers) in a compact form (to keep in a cache)"""
+    return array('l', ls)
+
+
+def _unpack_ids(packed):
+    """return the list of bioport ids that was packed with _pack_ids"""
+    return list(packed)
+
+
+def _year(d):
+    """return the year of d, which is either a date or a string in ISO format"""
+    if isinstance(d, basestring):
+        return int(d[:4])
+    return d.year
+
+
+def soundex_for_search(s):
+    """create long phonetic soundexes for the string s
+
+    (this is a module level function so it can be used in a pool of worker processes)
+    """
+    return soundexes_nl(
+        s,
+        group=2,
+        length=20,
+        filter_initials=True,
+        filter_stop_words=False,
+        wildcards=True,
+        )
+
+
 class DBRepository:
     """Interface with the MySQL database"""
     SIMILARITY_TRESHOLD = 0.70
     LOG_QUERY = False
+    USE_NAME_INDEX = False  # if True, search for exact names in an in-memory index instead of in the person_name table
+    NAME_INDEX_MAX_AGE = 3600  # rebuild the name index after this many seconds
+    NAME_INDEX_REFRESH = 60  # look for persons changed (by other processes) to update the name index after this many seconds
+    COUNT_CACHE_TTL = 60  # number of seconds that the results of count_persons are cached
+    RESULT_CACHE_TTL = 60  # number of seconds that the results of get_persons are cached
+    RESULT_CACHE_SIZE = 200  # the maximum number of results of get_persons that are cached
+    USE_BROWSE_INDEX = False  # if True, browsing persons by initial and category is done on the person_browse table
+    USE_DECADE_INDEX = False  # if True, the person_decade table is used to find persons alive in a period
+    USE_PERSON_CLUSTERS = False  # if True, redirections and identified persons are looked up in the person_cluster table
+    RANDOM_SAMPLER_MAX_AGE = 3600  # rebuild the list of persons to choose random persons from after this many seconds
+    RANDOM_SAMPLER_REFRESH = 60  # look for changed persons to update the random sampler after this many seconds
 
     def __init__(self,
         dsn,
@@ -101,18 +152,28 @@ class DBRepository:
         self.metadata = Base.metadata
         # get the data from the db
 
+        engine_args = {}
+        if not dsn.startswith('sqlite'):
+            # sqlite does not use a connection pool that can overflow
+            engine_args['max_overflow'] = 20
+            engine_args['pool_recycle'] = 3600  # set pool_recycle to one hour to avoid 'sql server has gone away' errors
         self.engine = self.metadata.bind = create_engine(
             dsn,
             convert_unicode=True,
             encoding='utf8',
             echo=echo,
-            max_overflow=20,
-            pool_recycle=3600  # set pool_recycle to one hour to avoid 'sql server has gone away' errors
+            **engine_args
             )
 
         self.Session = scoped_session(sessionmaker(bind=self.engine, extension=ZopeTransactionExtension()))
         self.db = self
         self.repository = repository
+        self._name_index = None
+        self._random_sampler = None
+        self.fulltext = get_fulltext_index(self)
+        self._persons_generation = 0
+        self._count_cache = LRUCache(maxsize=1000)
+        self._result_cache = LRUCache(maxsize=self.RESULT_CACHE_SIZE)
 
     @property
     def session(self):
@@ -283,6 +344,35 @@ class DBRepository:
         assert user
         biography.save(user=user, comment=comment)
         return biography
+
+    def _bump_versions(self, session, biography_id):
+        """increment the version numbers of all versions of this biography with one
+
+        (so that the new version of the biography can be saved as version 0)
+
+        arguments:
+            session: the current session
+            biography_id: the id of a biography
+        """
+        # the records of the old versions that we have in the session are now out of date
+        for obj in list(session.identity_map.values()):
+            if isinstance(obj, BiographyRecord) and obj.id == biography_id:
+                session.expunge(obj)
+        table = BiographyRecord.__table__
+        if self.engine.dialect.name == 'mysql':
+            # we start with the highest version, so we never have two records with the same (id, version)
+            session.execute(
+                'UPDATE %s SET version = version + 1 WHERE id = :id ORDER BY version DESC' % table.name,
+                {'id': biography_id},
+                )
+        else:
+            # other databases check the primary key after each row, so we take a detour via negative numbers
+            session.execute(table.update()
+                .where(and_(table.c.id == biography_id, table.c.version >= 0))
+                .values(version=-table.c.version - 1))
+            session.execute(table.update()
+                .where(and_(table.c.id == biography_id, table.c.version < 0))
+                .values(version=-table.c.version))
 #        with self.get_session_context() as session:
 #
 #            #if a corresponding person does not exist, we will create one
@@ -430,14 +520,22 @@ class DBRepository:
 
     def _soundex_for_search(self, s):
         # create long phonetic soundexes
-        return soundexes_nl(
-            s,
-            group=2,
-            length=20,
-            filter_initials=True,
-            filter_stop_words=False,
-            wildcards=True,
-            )
+        return soundex_for_search(s)
+
+    def _name_tokens(self, names):
+        """return the tokens of the names that we use for searching
+
+        arguments:
+            names : a list of Name instances
+        returns:
+            a list of (word, is_from_family_name) tuples
+        """
+        result = []
+        for name in names:
+            for token in name._guess_constituent_tokens():
+                is_from_family_name = (token.ctype() in [TYPE_TERRITORIAL , TYPE_FAMILYNAME, TYPE_INTRAPOSITON])
+                result.append((token.word(), is_from_family_name))
+        return result
 
     @instance.clearafter
     def update_name(self, bioport_id, names):
@@ -450,16 +548,55 @@ class DBRepository:
             # delete existing references
             session.query(PersonName).filter(PersonName.bioport_id == bioport_id).delete()
             session.query(PersonSoundex).filter(PersonSoundex.bioport_id == bioport_id).delete()
-            for name in names:
-                for token in name._guess_constituent_tokens():
-                    is_from_family_name = (token.ctype() in [TYPE_TERRITORIAL , TYPE_FAMILYNAME, TYPE_INTRAPOSITON])
-                    r = PersonName(bioport_id=bioport_id, name=token.word(), is_from_family_name=is_from_family_name)
+            tokens = self._name_tokens(names)
+            for word, is_from_family_name in tokens:
+                r = PersonName(bioport_id=bioport_id, name=word, is_from_family_name=is_from_family_name)
+                session.add(r)
+                soundex = self._soundex_for_search(word)
+                for soundex in soundex:
+#                    assert len(soundex) <= 1,  'token %s: soundex %s; bioport_id: %s' % (token, soundex, bioport_id)
+                    r = PersonSoundex(bioport_id=bioport_id, soundex=soundex, is_from_family_name=is_from_family_name)
                     session.add(r)
-                    soundex = self._soundex_for_search(token.word())
-                    for soundex in soundex:
-#                        assert len(soundex) <= 1,  'token %s: soundex %s; bioport_id: %s' % (token, soundex, bioport_id)
-                        r = PersonSoundex(bioport_id=bioport_id, soundex=soundex, is_from_family_name=is_from_family_name)
-                        session.add(r)
+        # (only now the changes are committed)
+        if self._name_index is not None:
+            self._name_index.update(bioport_id, tokens)
+
+    def get_name_index(self):
+        """return a NameIndex of the person_name table
+
+        the index is built on first use and rebuilt when it is older than NAME_INDEX_MAX_AGE.
+        In between, it is refreshed (at most every NAME_INDEX_REFRESH seconds) with
+        the names of the persons that have changed since the last refresh (cf. PersonRecord.timestamp),
+        so that we see the changes made by other processes.
+        (persons deleted by other processes may stay in the index, but they are
+        not found, as the results of the index are combined with the person table)
+        """
+        name_index = self._name_index
+        now = time.time()
+        if name_index is None or now - name_index.timestamp > self.NAME_INDEX_MAX_AGE:
+            logging.info('building the name index')
+            watermark = self._get_persons_watermark()
+            name_index = NameIndex()
+            qry = self.get_session().query(PersonName.bioport_id, PersonName.name, PersonName.is_from_family_name)
+            name_index.build(qry.all())
+            name_index.watermark = watermark
+            self._name_index = name_index
+        elif now - name_index.refreshed > self.NAME_INDEX_REFRESH:
+            watermark = self._get_persons_watermark()
+            if name_index.watermark is not None:
+                session = self.get_session()
+                qry = session.query(PersonRecord.bioport_id).filter(PersonRecord.timestamp >= name_index.watermark)
+                changed = [r[0] for r in qry.all()]
+                if changed:
+                    tokens = dict([(bioport_id, []) for bioport_id in changed])
+                    qry = session.query(PersonName.bioport_id, PersonName.name, PersonName.is_from_family_name)
+                    for bioport_id, name, is_from_family_name in qry.filter(PersonName.bioport_id.in_(changed)):
+                        tokens[bioport_id].append((name, is_from_family_name))
+                    for bioport_id, person_tokens in tokens.items():
+                        name_index.update(bioport_id, person_tokens)
+            name_index.watermark = watermark
+            name_index.refreshed = now
+        return name_index
 
     @instance.clearafter
     def update_soundex(self, bioport_id, names):
@@ -470,24 +607,117 @@ class DBRepository:
         """
         return self.update_name(bioport_id, names)
 
+    def _insert_names(self, session, persons, pool, insert_name, insert_soundex):
+        """insert the names and soundexes of these persons
+
+        arguments:
+            session: the current session
+            persons: a list of Person instances
+            pool: a multiprocessing.Pool to compute the soundexes with
+            insert_name, insert_soundex: the INSERT statements for the person_name and person_soundex rows
+        """
+        tokens = []
+        for person in persons:
+            for word, is_from_family_name in self._name_tokens(person.get_names()):
+                tokens.append((person.bioport_id, word, is_from_family_name))
+        words = list(set([word for _bioport_id, word, _is_from_family_name in tokens]))
+        soundexes = dict(zip(words, pool.map(soundex_for_search, words)))
+
+        name_rows = []
+        soundex_rows = []
+        for bioport_id, word, is_from_family_name in tokens:
+            name_rows.append(dict(bioport_id=bioport_id, name=word, is_from_family_name=is_from_family_name))
+            for soundex in soundexes[word]:
+                soundex_rows.append(dict(bioport_id=bioport_id, soundex=soundex, is_from_family_name=is_from_family_name))
+        if name_rows:
+            session.execute(insert_name, name_rows)
+        if soundex_rows:
+            session.execute(insert_soundex, soundex_rows)
 
     @instance.clearafter
-    def update_soundexes(self):
-        """update the person_soundex table in the database
+    def update_soundexes(self, processes=None, chunk_size=1000):
+        """rebuild the person_name and person_soundex tables in the database
+
+        The soundexes are computed in a pool of worker processes. On MySQL the
+        rows are loaded in shadow tables that are swapped in with a single
+        (atomic) RENAME TABLE, on other databases the tables are refilled in
+        a single transaction. In both cases name search keeps working while we
+        are rebuilding. Before the shadow tables are swapped in, the persons that
+        were changed or deleted in the meantime (cf. PersonRecord.timestamp) are redone.
+
+        arguments:
+            processes : the number of worker processes (default is the number of cpus)
+            chunk_size : the number of persons to process in one go
 
         use "update_persons" to update the information in the db (including person_soundex)
         """
-        with self.get_session_context() as session:
-            i = 0
-            logging.info('updating all soundexes (this can take a while)')
-            session.query(PersonSoundex).delete()
-            persons = self.get_persons()
-            for person in persons:
-                i += 1
-                if not i % 10:
-                    logging.info('%s of %s' % (i, len(persons)))
-                names = person.get_names()
-                self.update_soundex(person.bioport_id, names)
+        logging.info('updating all soundexes (this can take a while)')
+        name_table = PersonName.__tablename__
+        soundex_table = PersonSoundex.__tablename__
+        use_shadow_tables = self.engine.dialect.name == 'mysql'
+        if use_shadow_tables:
+            self.Session.remove()
+            for table in (name_table, soundex_table):
+                self.engine.execute('DROP TABLE IF EXISTS %s_new' % table)
+                self.engine.execute('CREATE TABLE %s_new LIKE %s' % (table, table))
+            insert_name = 'INSERT INTO %s_new' % name_table
+            insert_soundex = 'INSERT INTO %s_new' % soundex_table
+        else:
+            insert_name = 'INSERT INTO %s' % name_table
+            insert_soundex = 'INSERT INTO %s' % soundex_table
+        insert_name += ' (bioport_id, name, is_from_family_name) VALUES (:bioport_id, :name, :is_from_family_name)'
+        insert_soundex += ' (bioport_id, soundex, is_from_family_name) VALUES (:bioport_id, :soundex, :is_from_family_name)'
+
+        # we query the ids directly (get_persons may return cached results)
+        watermark = self._get_persons_watermark()
+        bioport_ids = self._query_persons_ids(hide_invisible=False, order_by=None)
+        total = len(bioport_ids)
+        pool = multiprocessing.Pool(processes)
+        try:
+            with self.get_session_context() as session:
+                if not use_shadow_tables:
+                    session.query(PersonName).delete()
+                    session.query(PersonSoundex).delete()
+                for start in range(0, total, chunk_size):
+                    logging.info('%s of %s' % (start, total))
+                    persons = PersonList(self.repository, bioport_ids[start:start + chunk_size])
+                    self._insert_names(session, persons, pool, insert_name, insert_soundex)
+
+            if use_shadow_tables:
+                # persons that were saved or deleted while we were busy have changed the old tables,
+                # so we redo them in the new ones before we swap them in
+                # (this leaves only the changes of the last moments before the RENAME)
+                with self.get_session_context() as session:
+                    changed = set()
+                    if watermark is not None:
+                        qry = session.query(PersonRecord.bioport_id).filter(PersonRecord.timestamp >= watermark)
+                        changed.update([r[0] for r in qry.all()])
+                    current_ids = self._query_persons_ids(hide_invisible=False, order_by=None)
+                    changed.update(set(bioport_ids) - set(current_ids))
+                    logging.info('updating %s persons that changed during the rebuild' % len(changed))
+                    changed = list(changed)
+                    for start in range(0, len(changed), chunk_size):
+                        chunk = ', '.join([str(int(bioport_id)) for bioport_id in changed[start:start + chunk_size]])
+                        for table in (name_table, soundex_table):
+                            session.execute('DELETE FROM %s_new WHERE bioport_id IN (%s)' % (table, chunk))
+                    current_ids = set(current_ids)
+                    changed = [bioport_id for bioport_id in changed if bioport_id in current_ids]
+                    for start in range(0, len(changed), chunk_size):
+                        persons = PersonList(self.repository, changed[start:start + chunk_size])
+                        self._insert_names(session, persons, pool, insert_name, insert_soundex)
+        finally:
+            pool.close()
+            pool.join()
+
+        if use_shadow_tables:
+            self.Session.remove()
+            self.engine.execute('RENAME TABLE '
+                '{name} TO {name}_old, {name}_new TO {name}, '
+                '{soundex} TO {soundex}_old, {soundex}_new TO {soundex}'.format(name=name_table, soundex=soundex_table))
+            for table in (name_table, soundex_table):
+                self.engine.execute('DROP TABLE %s_old' % table)
+        # the name index will be rebuilt on its next use
+        self._name_index = None
         logging.info('done')
 
     def fresh_identifier(self):
@@ -533,7 +763,10 @@ class DBRepository:
                     msg = 'This biography seems to have a bioport_id defined that is not present in the database'
                     raise Exception(msg)
                 # if this bioport_id redirects to another one, we remove that redirection (as we now attach biography to this id)
-                r_bioportidrecord.redirect_to = None
+                if r_bioportidrecord.redirect_to is not None:
+                    r_bioportidrecord.redirect_to = None
+                    session.flush()
+                    self._update_clusters(session, [bioport_id])
             else:
                 # try to find a bioport id in the reistry for this biography
                 qry = session.query(RelBioPortIdBiographyRecord).filter_by(biography_id=biography.id)
@@ -630,17 +863,52 @@ class DBRepository:
             for r in qry.all()]
 
         if bioport_id:
-            #        first those biographies that have the present bioport_id in their id -
-            #        then the rest, by quality
-            # (note that False comes before True when sorting, hence the 'not in')
-
-            bios = [(('bioport/%s' % bioport_id) not in bio.id, -bio.get_quality(), bio.id, bio) for bio in bios]
-            bios.sort()
-            bios = (x[-1] for x in bios)
-            # XXX - returning a generator breaks lots of upstream code, and is not really worth the trouble
-            bios = list(bios)
+            bios = self._order_biographies(bioport_id, bios)
         return bios
 
+    def _order_biographies(self, bioport_id, bios):
+        """return the biographies of the person with bioport_id in the order in which we present them"""
+        #        first those biographies that have the present bioport_id in their id -
+        #        then the rest, by quality
+        # (note that False comes before True when sorting, hence the 'not in')
+        bios = [(('bioport/%s' % bioport_id) not in bio.id, -bio.get_quality(), bio.id, bio) for bio in bios]
+        bios.sort()
+        return [x[-1] for x in bios]
+
+    def get_biographies_of_persons(self, bioport_ids):
+        """return the (current versions of the) biographies of all these persons, loaded in a single query
+
+        arguments:
+            bioport_ids: a list of bioport ids
+        returns:
+            a dictionary that maps each bioport_id to a list of Biography instances, ordered as in get_biographies
+        """
+        result = {}
+        if not bioport_ids:
+            return result
+        sources = dict([(source.id, source) for source in self.get_sources()])
+        qry = self.get_session().query(RelBioPortIdBiographyRecord.bioport_id, BiographyRecord)
+        qry = qry.filter(RelBioPortIdBiographyRecord.biography_id == BiographyRecord.id)
+        qry = qry.filter(RelBioPortIdBiographyRecord.bioport_id.in_(list(bioport_ids)))
+        qry = qry.filter(BiographyRecord.version == 0)
+        for bioport_id, r in qry.all():
+            bio = Biography(
+                id=r.id,
+                source_id=r.source_id,
+                repository=self.repository,
+                biodes_document=r.biodes_document,
+                source_url=r.source_url,
+                record=r,
+                version=r.version,
+                )
+            if r.source_id in sources:
+                # saves us a query for each biography
+                bio._source = sources[r.source_id]
+            result.setdefault(bioport_id, []).append(bio)
+        for bioport_id, bios in result.items():
+            result[bioport_id] = self._order_biographies(bioport_id, bios)
+        return result
+
     def _get_biography_query(self,
         source_id=None,
         bioport_id=None,
@@ -708,9 +976,58 @@ class DBRepository:
             raise BioPortException(msg)
         return ls[0]
 
+    def _persons_cache_key(self, args):
+        """return a hashable key that identifies the filter given by the arguments of _get_persons_query
+
+        arguments that do not change the filter (such as order_by) are ignored
+        """
+        items = []
+        for k, v in args.items():
+            if k in ('order_by', 'full_records'):
+                continue
+            if v is None or v == '' or v == []:
+                continue
+            if isinstance(v, list):
+                v = tuple(v)
+            items.append((k, v))
+        items.sort()
+        return tuple(items)
+
+    def invalidate_person_caches(self):
+        """invalidate the cached results of person queries
+
+        this must be called after persons have been changed (Person.save and delete_person do this),
+        or when the person table has been changed in some other way
+        """
+        self._persons_generation += 1
+        self._count_cache.clear()
+        self._result_cache.clear()
+
+    def _get_cached_count(self, key):
+        cached = self._count_cache.get(key)
+        if cached is not None:
+            timestamp, generation, total = cached
+            if generation == self._persons_generation and time.time() - timestamp < self.COUNT_CACHE_TTL:
+                return total
+        return None
+
+    def _set_cached_count(self, key, total):
+        self._count_cache.set(key, (time.time(), self._persons_generation, total))
+
     def count_persons(self, **args):
-        qry = self._get_persons_query(**args)
-        return qry.count()
+        """return the number of persons satisfying the given arguments
+
+        the results are cached for COUNT_CACHE_TTL seconds
+        """
+        key = self._persons_cache_key(args)
+        total = self._get_cached_count(key)
+        if total is None:
+            # the order does not matter for counting
+            args['order_by'] = None
+            qry = self._get_persons_query(**args)
+            total = qry.count()
+            self._set_cached_count(key, total)
+        return total
 
     def get_persons(self, **args):
         """Get persons satisfying the given arguments
@@ -722,15 +1039,328 @@ class DBRepository:
         """
         return self.get_persons_sequence(**args)
 
+    def get_persons_page(self, start=0, size=50, **args):
+        """return a page of the persons satisfying the given arguments, together with the total number of those persons
+
+        arguments:
+            start, size: the page to return
+            other arguments are as in get_persons
+        returns:
+            a tuple (persons, total), where persons is a PersonList instance
+        """
+        key = self._persons_cache_key(args)
+        total = self._get_cached_count(key)
+        if total is None:
+            # we need to find all persons anyway to count them, so we take our slice from these
+            ls = self._get_persons_ids(**args)
+            total = len(ls)
+            self._set_cached_count(key, total)
+            if size:
+                ls = ls[start:start + size]
+            else:
+                ls = ls[start:]
+        else:
+            ls = self._get_persons_ids(start=start, size=size, **args)
+        return PersonList(self.repository, ls), total
+
+    def get_persons_after(self, after=None, size=50, **args):
+        """return the persons that come after the person identified by after, in the order of sort_key
+
+        Unlike paging with start and size, this does not get slower for pages further down the list.
+
+        arguments:
+            after: None (for the first page), or the continuation returned by the previous call
+            size: the number of persons to return
+            other arguments are as in get_persons
+        returns:
+            a tuple (persons, after), where persons is a PersonList instance, and after is the continuation
+            to pass to the next call (or None if there are no more persons)
+        """
+        args['order_by'] = 'sort_key'
+        ls = self._get_persons_ids(after=after, size=size, **args)
+        if len(ls) < size:
+            continuation = None
+        else:
+            qry = self.get_session().query(PersonRecord.sort_key).filter(PersonRecord.bioport_id == ls[-1])
+            continuation = (qry.scalar(), ls[-1])
+        return PersonList(self.repository, ls), continuation
+
+    def iter_persons(self, batch_size=500, **args):
+        """iterate over all persons satisfying the given arguments, in the order of sort_key
+
+        the persons are retrieved batch_size at a time with get_persons_after
+        """
+        after = None
+        while True:
+            persons, after = self.get_persons_after(after=after, size=batch_size, **args)
+            for person in persons:
+                yield person
+            if after is None:
+                break
+
     def get_persons_sequence(self, **args):
         """return a PersonList instance"""
+        return PersonList(self.repository, self._get_persons_ids(**args))
+
+    def _get_persons_ids(self, **args):
+        """return the list of bioport_ids of the persons satisfying the given arguments
+
+        the results are cached (for RESULT_CACHE_TTL seconds, or until a person is changed)
+        """
         if args.get('full_records'):
             del args['full_records']
-        query = self._get_persons_query(**args)
+        if args.get('order_by') == 'random':
+            return self._get_random_persons_ids(**args)
+        if args.get('where_clause') or args.get('after') is not None:
+            # these results can not be (or are not likely to be) reused
+            return self._query_persons_ids(**args)
+        key = self._persons_cache_key(args) + (('order_by', args.get('order_by', 'sort_key')),)
+        cached = self._result_cache.get(key)
+        if cached is not None:
+            timestamp, generation, packed = cached
+            if generation == self._persons_generation and time.time() - timestamp < self.RESULT_CACHE_TTL:
+                return _unpack_ids(packed)
+        generation = self._persons_generation
+        ls = self._get_browse_ids(**args)
+        if ls is None:
+            ls = self._query_persons_ids(**args)
+        self._result_cache.set(key, (time.time(), generation, _pack_ids(ls)))
+        return ls
+
+    def update_decade_index(self, session, r_person):
+        """update the decades in which this person was alive
+
+        arguments:
+            session: the session in which the person is saved
+            r_person: a PersonRecord instance
+        (this is called from Person.save)
+
+        the index is only maintained if USE_DECADE_INDEX is True; after switching it on,
+        call rebuild_decade_index to fill it
+        """
+        if not self.USE_DECADE_INDEX:
+            return
+        session.query(PersonDecade).filter(PersonDecade.bioport_id == r_person.bioport_id).delete()
+        rows = self._decade_rows(r_person.bioport_id, r_person.geboortedatum_max, r_person.sterfdatum_min)
+        if rows:
+            session.execute(PersonDecade.__table__.insert(), rows)
+
+    def _decade_rows(self, bioport_id, geboortedatum_max, sterfdatum_min):
+        """return the rows of the decade index for a person"""
+        if not geboortedatum_max or not sterfdatum_min:
+            return []
+        begin = _year(geboortedatum_max)
+        end = _year(sterfdatum_min)
+        return [dict(bioport_id=bioport_id, decade=decade) for decade in range(begin // 10, end // 10 + 1)]
+
+    def rebuild_decade_index(self):
+        """fill the decade index from scratch
+
+        the person_decade table is created if it does not exist yet
+        (see datamanipulation/upgrade.py)
+        """
+        PersonDecade.__table__.create(bind=self.engine, checkfirst=True)
+        with self.get_session_context() as session:
+            session.query(PersonDecade).delete()
+            qry = session.query(PersonRecord.bioport_id, PersonRecord.geboortedatum_max, PersonRecord.sterfdatum_min)
+            qry = qry.filter(PersonRecord.geboortedatum_max != None)
+            qry = qry.filter(PersonRecord.sterfdatum_min != None)
+            rows = []
+            for bioport_id, geboortedatum_max, sterfdatum_min in qry.all():
+                rows += self._decade_rows(bioport_id, geboortedatum_max, sterfdatum_min)
+                if len(rows) > 1000:
+                    session.execute(PersonDecade.__table__.insert(), rows)
+                    rows = []
+            if rows:
+                session.execute(PersonDecade.__table__.insert(), rows)
+        self.invalidate_person_caches()
+
+    def _get_browse_ids(self,
+        beginletter=None,
+        category=None,
+        order_by='sort_key',
+        start=None,
+        size=None,
+        hide_invisible=True,
+        no_empty_names=True,
+        hide_no_external_biographies=True,
+        **args):
+        """return the bioport_ids of the persons with this initial and category from the browse index
 
+        the index only holds visible persons with a name and with external biographies
+        (i.e. the ones that are not orphans)
+
+        returns None if the index cannot be used for these arguments (and we need to query the person table)
+        """
+        if not self.USE_BROWSE_INDEX:
+            return None
+        if not hide_no_external_biographies:
+            return None
+        for k, v in args.items():
+            if v in (None, '', []) or (v is False and k != 'has_illustrations'):
+                continue
+            # other filters are used
+            return None
+        if order_by != 'sort_key' or not hide_invisible or not no_empty_names:
+            return None
+        if category:
+            try:
+                category_id = int(category)
+            except ValueError:
+                return None
+            if not category_id:
+                # XXX: _get_persons_query looks for persons without category in this case
+                return None
+        else:
+            category_id = 0
+        qry = self.get_session().query(PersonBrowse.bioport_id)
+        qry = qry.filter(PersonBrowse.initial == (beginletter or u''))
+        qry = qry.filter(PersonBrowse.category_id == category_id)
+        qry = qry.order_by(PersonBrowse.sort_key, PersonBrowse.bioport_id)
+        if size and int(size) > -1:
+            qry = qry.limit(size)
+        if start:
+            qry = qry.offset(start)
+        self._log_query('browse_index', qry)
+        return [r[0] for r in qry.all()]
+
+    def _browse_rows(self, bioport_id, initial, sort_key, category_ids):
+        """return the rows of the browse index for a visible person"""
+        rows = []
+        for browse_initial in set([initial or u'', u'']):
+            for category_id in [0] + list(category_ids):
+                rows.append(dict(
+                    initial=browse_initial,
+                    category_id=category_id,
+                    sort_key=sort_key or u'',
+                    bioport_id=bioport_id,
+                    ))
+        return rows
+
+    def update_browse_index(self, session, r_person, category_ids):
+        """update the rows of this person in the browse index
+
+        arguments:
+            session: the session in which the person is saved
+            r_person: a PersonRecord instance
+            category_ids: the ids of the categories of the person
+        (this is called from Person.save)
+
+        the index is only maintained if USE_BROWSE_INDEX is True; after switching it on,
+        call rebuild_browse_index to fill it
+        """
+        if not self.USE_BROWSE_INDEX:
+            return
+        session.query(PersonBrowse).filter(PersonBrowse.bioport_id == r_person.bioport_id).delete()
+        if r_person.has_name and not r_person.invisible and not r_person.orphan:
+            rows = self._browse_rows(r_person.bioport_id, r_person.initial, r_person.sort_key, category_ids)
+            session.execute(PersonBrowse.__table__.insert(), rows)
+
+    def rebuild_browse_index(self):
+        """fill the browse index from scratch with all visible persons
+
+        the person_browse table is created if it does not exist yet
+        (see datamanipulation/upgrade.py)
+        """
+        PersonBrowse.__table__.create(bind=self.engine, checkfirst=True)
+        with self.get_session_context() as session:
+            session.query(PersonBrowse).delete()
+            categories = {}
+            for bioport_id, category_id in session.query(RelPersonCategory.bioport_id, RelPersonCategory.category_id):
+                categories.setdefault(bioport_id, []).append(category_id)
+            qry = session.query(PersonRecord.bioport_id, PersonRecord.initial, PersonRecord.sort_key)
+            qry = qry.filter(PersonRecord.has_name == True)
+            qry = qry.filter(PersonRecord.invisible == False)
+            qry = qry.filter(PersonRecord.orphan == False)
+            rows = []
+            for bioport_id, initial, sort_key in qry.all():
+                rows += self._browse_rows(bioport_id, initial, sort_key, categories.get(bioport_id, []))
+                if len(rows) > 1000:
+                    session.execute(PersonBrowse.__table__.insert(), rows)
+                    rows = []
+            if rows:
+                session.execute(PersonBrowse.__table__.insert(), rows)
+        self.invalidate_person_caches()
+
+    def _get_random_persons_ids(self, start=None, size=None, **args):
+        """return a uniform random sample of size bioport_ids of the persons satisfying the given arguments
+
+        (without a size, all bioport_ids are returned in random order)
+        """
+        assert not start, 'we cannot page through random results (there is no "start" in a random sample)'
+        args['order_by'] = None
+        if self._persons_cache_key(args):
+            # draw a sample from the (cached) results of the filter
+            ls = self._get_persons_ids(**args)
+            return random.sample(ls, min(int(size or len(ls)), len(ls)))
+        elif not size:
+            ls = self._query_persons_ids(**args)
+            random.shuffle(ls)
+            return ls
+        else:
+            # these are all visible persons: we use the sampler
+            sampler = self.get_random_sampler()
+            n = int(size)
+            ls = sampler.sample(n)
+            while ls:
+                # the sampler may not know yet about persons deleted by another process
+                qry = self.get_session().query(PersonRecord.bioport_id).filter(PersonRecord.bioport_id.in_(ls))
+                existing = set([r[0] for r in qry])
+                if len(existing) == len(ls):
+                    break
+                for bioport_id in ls:
+                    if bioport_id not in existing:
+                        sampler.remove(bioport_id)
+                ls = [bioport_id for bioport_id in ls if bioport_id in existing]
+                ls += [bioport_id for bioport_id in sampler.sample(n) if bioport_id not in existing][:n - len(ls)]
+            return ls
+
+    def get_random_sampler(self):
+        """return an IdSampler of the bioport_ids of all visible persons
+
+        the sampler is built on first use and rebuilt when it is older than RANDOM_SAMPLER_MAX_AGE.
+        In between, it is refreshed (at most every RANDOM_SAMPLER_REFRESH seconds) with
+        the persons that have changed since the last refresh. Persons deleted by other
+        processes leave no trace, so they stay in the sampler until they are drawn
+        (cf. _get_random_persons_ids) or the sampler is rebuilt.
+        """
+        sampler = self._random_sampler
+        now = time.time()
+        if sampler is None or now - sampler.timestamp > self.RANDOM_SAMPLER_MAX_AGE:
+            sampler = self._build_random_sampler()
+        elif now - sampler.refreshed > self.RANDOM_SAMPLER_REFRESH:
+            watermark = self._get_persons_watermark()
+            if sampler.watermark is not None:
+                changed_since = PersonRecord.timestamp >= sampler.watermark
+                qry = self.get_session().query(PersonRecord.bioport_id).filter(changed_since)
+                changed = [r[0] for r in qry.all()]
+                if changed:
+                    visible = set(self._query_persons_ids(order_by=None, where_clause=changed_since))
+                    for bioport_id in changed:
+                        if bioport_id in visible:
+                            sampler.add(bioport_id)
+                        else:
+                            sampler.remove(bioport_id)
+            sampler.watermark = watermark
+            sampler.refreshed = now
+        return sampler
+
+    def _build_random_sampler(self):
+        logging.info('building the random sampler')
+        watermark = self._get_persons_watermark()
+        sampler = IdSampler(self._query_persons_ids(order_by=None))
+        sampler.watermark = watermark
+        self._random_sampler = sampler
+        return sampler
+
+    def _get_persons_watermark(self):
+        """return the timestamp of the most recently changed person"""
+        return self.get_session().query(sqlalchemy.func.max(PersonRecord.timestamp)).scalar()
+
+    def _query_persons_ids(self, **args):
+        query = self._get_persons_query(**args)
         ls = query.session.execute(query).fetchall()
-        ls = [r[0] for r in ls]
-        return PersonList(self.repository, ls)
+        return [r[0] for r in ls]
 
     def _log_query(self, label, qry):
         if self.LOG_QUERY:
@@ -757,7 +1387,7 @@ class DBRepository:
         has_illustrations=None,  # boolean: does this person have illustrations?
         is_identified=None,
         match_term=None,  # use for myqsl 'matching' (With stopwords and stuff)
-        order_by='sort_key',
+        order_by='sort_key',  # a column name, 'random', or 'relevance' (to rank the results of search_term)
         place=None,
         religion=None,
         search_term=None,  #
@@ -777,6 +1407,7 @@ class DBRepository:
         sterfplaats=None,
         start=None,
         size=None,
+        after=None,  # a tuple (sort_key, bioport_id): only return persons that come after this one when sorted on sort_key
         status=None,
         hide_invisible=True,  # if true, do not return "invisible" persons, such as those marked as "troep"
         hide_foreigners=False,  # if true, do not return persons marked as "buitenlands"
@@ -822,7 +1453,15 @@ class DBRepository:
         qry = qry.filter(PersonRecord.orphan == False)  # @IgnorePep8
         self._log_query('not_orphan', qry)
 
-        if is_identified:
+        if is_identified and self.USE_PERSON_CLUSTERS:
+            # a person is identified if it is the canonical person of a cluster
+            canonical_ids = sqlalchemy.select(
+                [PersonCluster.canonical_id],
+                PersonCluster.bioport_id != PersonCluster.canonical_id,
+                )
+            qry = qry.filter(PersonRecord.bioport_id.in_(canonical_ids))
+            self._log_query('is_identified', qry)
+        elif is_identified:
             # a person is identified if another bioport id redirects to it
             # XXX: this is not a good definition
             PBioPortIdRecord = aliased(BioPortIdRecord)
@@ -896,6 +1535,9 @@ class DBRepository:
 
         levend_date_filter = self._get_date_filter(locals(), 'levend')
         if levend_date_filter != "TRUE":
+            if self.USE_DECADE_INDEX and levendjaar_min:
+                start_date, end_date = self._get_period(locals(), 'levend')
+                qry = self._join_alive_candidates(qry, start_date, end_date)
             qry = qry.filter(levend_date_filter)
             self._log_query('levend_date_filter', qry)
 
@@ -932,15 +1574,8 @@ class DBRepository:
             self._log_query('match_term', qry)
 
         if search_term:
-            # full-text search
-            ### next code is for MATCH ###
-            # Mysql uses the OR operator by default
-            # with a '+' in front of each word we use the AND operator
-            words = re.split('\W+', search_term)
-            words_with_plus = ['+' + word for word in words]
-            words_query = ' '.join(words_with_plus)
-            qry = qry.filter('match (search_source) against '
-                              '("%s" in boolean mode)' % words_query)
+            # full-text search (if order_by is 'relevance', the best matches come first)
+            qry = self.fulltext.filter(qry, search_term, rank=(order_by == 'relevance'))
             self._log_query('search_term', qry)
 
         qry = self._filter_search_name(qry, search_name, search_family_name_only=search_family_name_only)
@@ -977,14 +1612,35 @@ class DBRepository:
 
         if order_by:
             if order_by == 'random':
-                # XXX this is perhaps a slow way of doing is; for our purposes it is also enough to pick a random
-                # id, and do somethin like "where id > randomlypickednumber limit XXX"
-                some_bioportid = ''.join([random.choice('0123456789') for _i in range(LENGTH)])
-                qry = qry.filter(PersonRecord.bioport_id > some_bioportid)
+                # the random sample is drawn from the results in _get_random_persons_ids
+                pass
+            elif order_by == 'relevance':
+                # the results are ranked by the fulltext index
+                if not search_term:
+                    qry = qry.order_by('sort_key')
+            elif order_by == 'sort_key':
+                # we sort on bioport_id as well, so that the order is always the same (which we need for paging)
+                qry = qry.order_by(PersonRecord.sort_key, PersonRecord.bioport_id)
             else:
                 qry = qry.order_by(order_by)
             self._log_query('order_by', qry)
 
+        if after is not None:
+            assert order_by == 'sort_key', 'we can only page with "after" when sorting on sort_key'
+            after_sort_key, after_bioport_id = after
+            if after_sort_key is None:
+                # persons without a sort key come first
+                qry = qry.filter(or_(
+                    PersonRecord.sort_key != None,
+                    and_(PersonRecord.sort_key == None, PersonRecord.bioport_id > after_bioport_id),
+                    ))
+            else:
+                qry = qry.filter(or_(
+                    PersonRecord.sort_key > after_sort_key,
+                    and_(PersonRecord.sort_key == after_sort_key, PersonRecord.bioport_id > after_bioport_id),
+                    ))
+            self._log_query('after', qry)
+
         if has_contradictions:
             qry = qry.filter(PersonRecord.has_contradictions == True)
             self._log_query('has_contradictions', qry)
@@ -1034,6 +1690,54 @@ class DBRepository:
         else:
             return None
 
+    def _get_period(self, data, datetype):
+        """return the period given by the year, month and day values for datetype in data
+
+        returns:
+            a tuple (start_date, end_date) of strings in ISO format
+        """
+        jaar_min = int(data[datetype + 'jaar_min'] or 1)
+        jaar_max = int(data[datetype + 'jaar_max'] or 9000)
+        maand_min = int(data[datetype + 'maand_min'] or 1)
+        dag_min = int(data[datetype + 'dag_min'] or 1)
+        maand_max = int(data[datetype + 'maand_max'] or 12)
+        dag_max = int(data[datetype + 'dag_max'] or 0)
+        start_date = "%04i-%02i-%02i" % (jaar_min, maand_min, dag_min)
+        if dag_max:
+            end_date = "%04i-%02i-%02i" % (jaar_max, maand_max, dag_max)
+        else:
+            end_date = "%04i-%02i" % (jaar_max, maand_max)
+        return start_date, end_date
+
+    def _join_alive_candidates(self, qry, start_date, end_date):
+        """restrict qry to the persons that may have been alive between start_date and end_date, using the decade index
+
+        A person alive in the period was either born in the period, or was born earlier
+        and alive at its start (and so has a row in person_decade for the decade of the start).
+        Both sets are found with an index, and their union is joined to the query, so that
+        the database does not have to scan all persons born before the end of the period.
+        (the levend date filter must still be applied to the query)
+
+        arguments:
+            qry: a Query on PersonRecord
+            start_date, end_date: strings in ISO format, as returned by _get_period
+        returns:
+            a Query instance
+        """
+        born_in_period = sqlalchemy.select(
+            [PersonRecord.bioport_id],
+            and_(
+                PersonRecord.geboortedatum_max >= format_date(to_date(start_date)),
+                PersonRecord.geboortedatum_max <= format_date(to_date(end_date, round='up')),
+                ),
+            )
+        alive_in_decade = sqlalchemy.select(
+            [PersonDecade.bioport_id],
+            PersonDecade.decade == int(start_date[:4]) // 10,
+            )
+        candidates = sqlalchemy.union(born_in_period, alive_in_decade).alias('alive_candidates')
+        return qry.join((candidates, candidates.c.bioport_id == PersonRecord.bioport_id))
+
     def _get_date_filter(self, data, datetype):
         """
         This function builds a sqlalchemy filter using data in 'data'.
@@ -1059,13 +1763,7 @@ class DBRepository:
             return date_filter
 
         if datjaar_min or datjaar_max:
-            jaar_min = int(datjaar_min or 1)
-            jaar_max = int(datjaar_max or 9000)
-            start_date = "%04i-%02i-%02i" % (jaar_min, maand_min, dag_min)
-            if dag_max:
-                end_date = "%04i-%02i-%02i" % (jaar_max, maand_max, dag_max)
-            else:
-                end_date = "%04i-%02i" % (jaar_max, maand_max)
+            start_date, end_date = self._get_period(data, datetype)
             if datetype == 'levend':
                 date_filter = and_(
                        self._apply_date_operator('geboorte', '<=', end_date),
@@ -1081,21 +1779,16 @@ class DBRepository:
               or datmaand_max or datdag_max):
             # the user has not specified a year, only a date
             # basically, we are now searching for people that have a birthday (or died on a date) in a certain range
-            field_min = getattr(PersonRecord, datetype + 'datum_min', None)
-            field_max = getattr(PersonRecord, datetype + 'datum_max', None)
-            SUBSTRING = sqlalchemy.func.SUBSTRING
-            field_without_year = SUBSTRING(field_min, 6, 5)
-            start_date = "%02i-%02i" % (maand_min, dag_min)
-            end_date = "%02i-%02i" % (maand_max, dag_max)
+            # Person.save stores the day (as MMDD) in the indexed birthday and deathday columns
+            # (only for persons of whom we are sure about the date)
+            field = {'geboorte': PersonRecord.birthday, 'sterf': PersonRecord.deathday}[datetype]
+            start_date = "%02i%02i" % (maand_min, dag_min)
+            end_date = "%02i%02i" % (maand_max, dag_max or 31)
             if start_date > end_date:
-                date_filter = or_(field_without_year >= start_date, field_without_year <= end_date)
+                # the range wraps around the end of the year
+                date_filter = or_(field >= start_date, field <= end_date)
             else:
-                date_filter = and_(field_without_year >= start_date, field_without_year <= end_date)
-
-            # We want the month to be specified, i.e. at least a 7-char date
-            date_filter = and_(date_filter, sqlalchemy.func.length(field_min) >= 7)
-            # also, we want to consider only cases in which we are sure about the date
-            date_filter = and_(date_filter, field_min == field_max)
+                date_filter = and_(field >= start_date, field <= end_date)
         return date_filter
 
 
@@ -1148,6 +1841,10 @@ class DBRepository:
             if search_name.endswith('"'):
                 search_name = search_name[:-1]
 
+            if self.USE_NAME_INDEX:
+                bioport_ids = self.get_name_index().search(search_name.split(), family_name_only=search_family_name_only)
+                return qry.filter(PersonRecord.bioport_id.in_(list(bioport_ids)))
+
             for s in search_name.split():
                 # changed this to a faster separate table with the "words" that we are searching for
 #                    qry = qry.filter(PersonRecord.names.op('regexp')(u'[[:<:]]%s[[:>:]]' % s))
@@ -1181,7 +1878,7 @@ class DBRepository:
         """
         if search_soundex:
             soundexes = self._soundex_for_search(search_soundex)
-            if len(soundexes) == 1 and  '?' in soundexes[0] or '*' in soundexes[0]:
+            if soundexes and (len(soundexes) == 1 and  '?' in soundexes[0] or '*' in soundexes[0]):
                 # we can use wildcards, but only if we have a single soundex
                 s = soundexes[0]
                 s = s.replace('?', '_')
@@ -1191,16 +1888,27 @@ class DBRepository:
                 if search_family_name_only:
                     qry = qry.filter(PersonSoundex.is_from_family_name == True)
                 qry = qry.filter(PersonSoundex.soundex.like(s))
-            else:
-                for s in soundexes:
-                    alias = aliased(PersonSoundex)
-                    qry = qry.join(alias)
-                    qry = qry.distinct()
-                    qry = qry.filter(alias.soundex == s)
-                    if search_family_name_only:
-                        qry = qry.filter(alias.is_from_family_name == True)
+            elif soundexes:
+                # find the persons that have all soundexes in a single grouped query
+                # (instead of joining person_soundex once for each soundex)
+                soundexes = set(soundexes)
+                subqry = qry.session.query(PersonSoundex.bioport_id)
+                subqry = subqry.filter(PersonSoundex.soundex.in_(soundexes))
+                if search_family_name_only:
+                    subqry = subqry.filter(PersonSoundex.is_from_family_name == True)
+                subqry = subqry.group_by(PersonSoundex.bioport_id)
+                subqry = subqry.having(sqlalchemy.func.count(sqlalchemy.distinct(PersonSoundex.soundex)) == len(soundexes))
+                subqry = subqry.subquery()
+                qry = qry.join((subqry, subqry.c.bioport_id == PersonRecord.bioport_id))
         return qry
 
+    def get_person_records(self, bioport_ids):
+        """return a dictionary with the PersonRecords of these bioport_ids, loaded in one query"""
+        if not bioport_ids:
+            return {}
+        qry = self.get_session().query(PersonRecord).filter(PersonRecord.bioport_id.in_(list(bioport_ids)))
+        return dict([(r.bioport_id, r) for r in qry.all()])
+
     def get_person(self, bioport_id, repository=None):
         if not bioport_id:
             return
@@ -1214,30 +1922,52 @@ class DBRepository:
     @instance.clearafter
     def delete_person(self, person):
         with self.get_session_context() as session:
-            try:
-                # BB manual deletion of related records, no ' on delete cascade' ?
-                session.query(PersonSoundex).filter(PersonSoundex.bioport_id == person.bioport_id).delete()
-#                 session.query(PersonName).filter(PersonName.bioport_id == person.bioport_id).delete()
-#                 session.query(PersonSource).filter(PersonSource.bioport_id == person.bioport_id).delete()
-#                 session.query(NaamRecord).filter(NaamRecord.bioport_id == person.bioport_id).delete()
-                session.query(RelPersonCategory).filter(RelPersonCategory.bioport_id == person.bioport_id).delete()
-                session.query(RelPersonReligion).filter(RelPersonReligion.bioport_id == person.bioport_id).delete()
-
-                r = session.query(PersonRecord).filter(PersonRecord.bioport_id == person.get_bioport_id()).one()
-                session.delete(r)
-                msg = 'Deleted person %s' % person.bioport_id
-                self.log(msg, r)
-            except NoResultFound:
-                pass
+            self._delete_person_records(session, person.get_bioport_id())
+        self._person_deleted(person.get_bioport_id())
+
+    def _delete_person_records(self, session, bioport_id):
+        """delete the record of the person with this bioport_id, and the records that refer to it
+
+        arguments:
+            session: the current session
+            bioport_id: a bioport id
+        """
+        try:
+            # BB manual deletion of related records, no ' on delete cascade' ?
+            session.query(PersonSoundex).filter(PersonSoundex.bioport_id == bioport_id).delete()
+            self.fulltext.remove(session, bioport_id)
+#             session.query(PersonName).filter(PersonName.bioport_id == bioport_id).delete()
+#             session.query(PersonSource).filter(PersonSource.bioport_id == bioport_id).delete()
+#             session.query(NaamRecord).filter(NaamRecord.bioport_id == bioport_id).delete()
+            session.query(RelPersonCategory).filter(RelPersonCategory.bioport_id == bioport_id).delete()
+            if self.USE_BROWSE_INDEX:
+                session.query(PersonBrowse).filter(PersonBrowse.bioport_id == bioport_id).delete()
+            if self.USE_DECADE_INDEX:
+                session.query(PersonDecade).filter(PersonDecade.bioport_id == bioport_id).delete()
+            session.query(RelPersonReligion).filter(RelPersonReligion.bioport_id == bioport_id).delete()
+
+            r = session.query(PersonRecord).filter(PersonRecord.bioport_id == bioport_id).one()
+            session.delete(r)
+            msg = 'Deleted person %s' % bioport_id
+            self.log(msg, r)
+        except NoResultFound:
+            pass
 
         # remove from cache similarity
-        with self.get_session_context() as session:
-            qry = session.query(CacheSimilarityPersons)
-            qry = qry.filter(or_(
-                CacheSimilarityPersons.bioport_id1 == person.get_bioport_id(),
-                CacheSimilarityPersons.bioport_id2 == person.get_bioport_id()
-                ))
-            qry.delete()
+        qry = session.query(CacheSimilarityPersons)
+        qry = qry.filter(or_(
+            CacheSimilarityPersons.bioport_id1 == bioport_id,
+            CacheSimilarityPersons.bioport_id2 == bioport_id
+            ))
+        qry.delete(synchronize_session=False)
+
+    def _person_deleted(self, bioport_id):
+        """update what we keep in memory after the deletion of the person with this bioport_id is committed"""
+        if self._name_index is not None:
+            self._name_index.remove(bioport_id)
+        if self._random_sampler is not None:
+            self._random_sampler.remove(bioport_id)
+        self.invalidate_person_caches()
 
     def get_author(self, author_id):
         session = self.get_session()
@@ -1253,6 +1983,8 @@ class DBRepository:
             r = qry.one()
             # add a new record for the redirection
             r.redirect_to = redirect_to
+            session.flush()
+            self._update_clusters(session, [bioport_id])
 
     def redirects_to(self, bioport_id):
         """follow the rediriction chain to an endpoint
@@ -1264,6 +1996,12 @@ class DBRepository:
         NB:
             returns bioport_id if no further redirection is found
         """
+        if self.USE_PERSON_CLUSTERS:
+            qry = self.get_session().query(PersonCluster.canonical_id).filter(PersonCluster.bioport_id == bioport_id)
+            r = qry.first()
+            if r is None:
+                return bioport_id
+            return r[0]
         orig_id = bioport_id
         chain = [orig_id]
         i = 0
@@ -1513,72 +2251,179 @@ class DBRepository:
         """
 
         logging.info('Identifying {person1.bioport_id} and {person2.bioport_id}'.format(person1=person1, person2=person2))
-        # we need to merge the two persons, and choose one as the one to "point to"
-        # we take the one that uses a biography with the highest trustworthiness
+        if person1.bioport_id == person2.bioport_id:
+            # these two persons are already identified
+            return person1
+        return self.identify_batch([(person1, person2)])[0]
 
-        with self.get_session_context() as session:
+    @instance.clearafter
+    def identify_batch(self, pairs):
+        """identify the persons in each of the pairs
+
+        The pairs are grouped into clusters of persons that are all the same person.
+        In each cluster, the person that comes first in the pairs "survives": the biographies
+        of the others are attached to this person, their identifiers are redirected to it,
+        and the others are deleted. Each surviving person is saved only once.
 
-            # make sure we have fresh records from the db
-            # (they may have been changed by a previous operation when identification happens in batch)
-            person1._fresh_record()
-            person2._fresh_record()
+        The clusters are identified one after the other, each in a few transactions
+        (cf. _identify_cluster). If this is interrupted, the clusters that were done stay done,
+        and calling identify_batch again with the same pairs finishes the rest.
 
-            if person1.bioport_id == person2.bioport_id:
-                # these two persons are already identified
-                return person1
+        arguments:
+            pairs - a list of (person1, person2) tuples of Person instances
+        returns:
+            a list of Person instances - the surviving person of each cluster
+        """
+        if not pairs:
+            return []
+        logging.info('Identifying %s pairs of persons' % len(pairs))
+
+        # the persons in the pairs may have been identified with others already
+        bioport_ids = set()
+        for person1, person2 in pairs:
+            bioport_ids.add(person1.bioport_id)
+            bioport_ids.add(person2.bioport_id)
+        current_ids = self._current_bioport_ids(bioport_ids)
+
+        # find the clusters (with union-find)
+        parent = {}
+
+        def find(bioport_id):
+            root = bioport_id
+            while parent.get(root, root) != root:
+                root = parent[root]
+            while bioport_id != root:
+                parent[bioport_id], bioport_id = root, parent[bioport_id]
+            return root
+
+        order = []  # the bioport_ids in the order in which we saw them
+        for person1, person2 in pairs:
+            id1 = current_ids[person1.bioport_id]
+            id2 = current_ids[person2.bioport_id]
+            for bioport_id in (id1, id2):
+                if bioport_id not in parent:
+                    parent[bioport_id] = bioport_id
+                    order.append(bioport_id)
+            root1 = find(id1)
+            root2 = find(id2)
+            if root1 != root2:
+                parent[root2] = root1
+
+        # the members of each cluster, in the order in which we saw them
+        # (the root of the union-find tree is not necessarily the first of these)
+        clusters = {}
+        members = []
+        for bioport_id in order:
+            root = find(bioport_id)
+            if root not in clusters:
+                clusters[root] = []
+                members.append(clusters[root])
+            clusters[root].append(bioport_id)
+
+        biographies = self.get_biographies_of_persons(list(parent))
+        records = self.get_person_records(list(parent))
 
-            trust1 = max([bio.get_source().quality for bio in person1.get_biographies() if bio.get_source().id != 'bioport'] + [0])
-            trust2 = max([bio.get_source().quality for bio in person2.get_biographies() if bio.get_source().id != 'bioport'] + [0])
+        result = []
+        for cluster in members:
+            # the person we saw first survives
+            survivor, others = cluster[0], cluster[1:]
+            if others:
+                self._identify_cluster(survivor, others, biographies, records)
+            person = self.get_person(survivor)
+            if others:
+                person.save()
+            result.append(person)
+        return result
 
-            if trust1 > trust2:
-                new_person = person1
-                old_person = person2
-            else:
-                new_person = person1
-                old_person = person2
-
-            if new_person.status == STATUS_ONLY_VISIBLE_IF_CONNECTED:
-                new_person.record.status = old_person.status
-                self.save_person(new_person)
-
-            # create a new 'merged biography' to add to the new person
-            bio1 = self.repository.get_bioport_biography(new_person, create_if_not_exists=False)
-            bio2 = self.repository.get_bioport_biography(old_person, create_if_not_exists=False)
-            if bio1 and bio2:
-                merged_bio = BiographyMerger.merge_biographies(bio1, bio2)
+    def _current_bioport_ids(self, bioport_ids):
+        """return a dictionary that maps each of bioport_ids to the id of the person it currently belongs to"""
+        existing = self.get_person_records(list(bioport_ids))
+        result = {}
+        for bioport_id in bioport_ids:
+            if bioport_id in existing:
+                result[bioport_id] = bioport_id
             else:
-                merged_bio = None
-
-            # now attach the biographies of old_person to new_person
-            for bio in old_person.get_biographies():
-                new_person.add_biography(
-                    bio,
-                    comment='Identified %s and %s: added biography %s to %s' % (person1.name(), person2.name(), bio, new_person),
-                    )
+                result[bioport_id] = self.redirects_to(bioport_id)
+        return result
 
-            if merged_bio:
-                new_person.add_biography(
-                    merged_bio,
-                    comment='Identified %s and %s: added merged biography to %s' % (person1.name(), person2.name(), new_person)
-                    )
+    def _identify_cluster(self, bioport_id, others, biographies, records):
+        """attach the biographies of the persons with the ids in others to the person with bioport_id
 
-            # changhe de bioportid table
-            self.redirect_identifier(old_person.get_bioport_id(), new_person.get_bioport_id())
+        Biography.save commits each biography in a transaction of its own, so the work is done in steps
+        that can be repeated if we are interrupted:
+            1. the merged "bioport" biography and the biographies of the others are saved as biographies
+               of the survivor (the others still exist, and will be identified again)
+            2. in one transaction, the identifiers of the others are redirected to the survivor,
+               and the others are deleted
+        The caller saves the survivor afterwards (if that is interrupted, the survivor
+        is out of date until it is saved again).
 
-            # we identified so we can remove this pair from the deferred list
-            self._remove_from_cache_deferidentification(new_person, old_person)
-            self._remove_from_cache_similarity_persons(old_person)
+        arguments:
+            bioport_id: the bioport_id of the surviving person
+            others: the bioport_ids of the persons that are identified with the survivor
+            biographies: a dictionary that maps bioport_ids to lists of Biography instances
+            records: a dictionary that maps bioport_ids to PersonRecords
+        """
+        survivor = Person(bioport_id, repository=self.repository, record=records.get(bioport_id))
+        comment = 'Identified %s and %s' % (bioport_id, ', '.join([str(other) for other in others]))
 
-            # now delete the old person from the Person table
-            self.delete_person(old_person)
+        if survivor.status == STATUS_ONLY_VISIBLE_IF_CONNECTED:
+            for other in others:
+                if other in records:
+                    survivor.record.status = records[other].status
+                    break
 
-            new_person.save()
+        # merge the "bioport" biographies (that contain the interventions of the editors)
+        bioport_bios = [self._bioport_biography(biographies.get(other, [])) for other in [bioport_id] + others]
+        merged_bio = bioport_bios[0]
+        changed = False
+        if merged_bio:
+            for bio in bioport_bios[1:]:
+                if bio and BiographyMerger.merge_biographies(merged_bio, bio):
+                    changed = True
+
+        if changed:
+            merged_bio._person = survivor
+            merged_bio.save(
+                user=self.repository.user,
+                comment='%s: added merged biography to %s' % (comment, bioport_id),
+                update_person=False,
+                )
+        # attach the biographies of the others to the survivor
+        for other in others:
+            for bio in biographies.get(other, []):
+                bio.set_value('bioport_id', bioport_id)
+                bio._person = survivor
+                bio.save(
+                    user=self.repository.user,
+                    comment='%s: added biography %s to %s' % (comment, bio, bioport_id),
+                    update_person=False,
+                    )
 
-            # now delete the old person from the Person table
-            self.delete_person(old_person)
-            new_person.save()
+        with self.get_session_context() as session:
+            # redirect the identifiers of the others
+            qry = session.query(BioPortIdRecord).filter(BioPortIdRecord.bioport_id.in_(others))
+            qry.update({BioPortIdRecord.redirect_to: bioport_id}, synchronize_session=False)
+            self._update_clusters(session, [bioport_id] + others)
 
-        return new_person
+            # we identified so we can remove these pairs from the deferred list
+            cluster = [bioport_id] + others
+            qry = session.query(DeferIdentificationRecord)
+            qry = qry.filter(DeferIdentificationRecord.bioport_id1.in_(cluster))
+            qry = qry.filter(DeferIdentificationRecord.bioport_id2.in_(cluster))
+            qry.delete(synchronize_session=False)
+
+            # now delete the others from the Person table (this also removes them from the similarity cache)
+            for other in others:
+                self._delete_person_records(session, other)
+        for other in others:
+            self._person_deleted(other)
+
+    def _bioport_biography(self, biographies):
+        """return the bioport biography from the list of biographies, or None"""
+        for bio in biographies:
+            if bio.source_id == 'bioport':
+                return bio
 
     @instance.clearafter
     def find_biography_contradictions(self):
@@ -1696,11 +2541,125 @@ class DBRepository:
     def get_identified(self, **args):
         """get all persons that have been identified (with other persons)
 
-        what we really want is the "canonical" ids of the persons that have been identified
-        (not the ones that are redirecting to others, as we have now)
+        NB: the meaning of "identified" depends on USE_PERSON_CLUSTERS:
+        - if it is False, these are the persons that another bioport id redirects to directly
+          (in a chain of redirections a -> b -> c, this includes b, which is not a visible person)
+        - if it is True, these are the canonical persons of the clusters in person_cluster,
+          i.e. the persons at the end of the redirections (only c in the example)
         """
         return self.get_persons(is_identified=True, **args)
 
+    def get_cluster(self, bioport_id):
+        """return the bioport ids of which the person with this bioport_id is made up
+
+        arguments:
+            bioport_id: a bioport identifier
+        returns:
+            a sorted list of bioport identifiers (the first being the canonical one)
+        """
+        canonical_id = self.redirects_to(bioport_id)
+        session = self.get_session()
+        if self.USE_PERSON_CLUSTERS:
+            qry = session.query(PersonCluster.bioport_id).filter(PersonCluster.canonical_id == canonical_id)
+            members = set([r[0] for r in qry])
+        else:
+            # follow the redirections backwards
+            members = set()
+            todo = [canonical_id]
+            while todo:
+                members.update(todo)
+                qry = session.query(BioPortIdRecord.bioport_id).filter(BioPortIdRecord.redirect_to.in_(todo))
+                todo = [r[0] for r in qry if r[0] not in members]
+        members.discard(canonical_id)
+        return [canonical_id] + sorted(members)
+
+    def _update_clusters(self, session, bioport_ids):
+        """recompute the rows in person_cluster of the clusters of bioport_ids
+
+        this must be called after changing the redirections of these bioport_ids.
+        The table is only maintained if USE_PERSON_CLUSTERS is True: the rows computed here
+        are only correct if the table was complete before, so after switching it on,
+        call rebuild_person_clusters to fill it.
+
+        arguments:
+            session: the current session
+            bioport_ids: a list of bioport ids whose redirection has changed
+        """
+        if not self.USE_PERSON_CLUSTERS:
+            return
+        # find all ids that may be affected: the members of the (old) clusters of these ids
+        # and the ids they redirect to, and the members of those clusters, etc
+        redirects = {}
+        affected = set()
+        todo = set(bioport_ids)
+        while todo:
+            affected.update(todo)
+            todo = list(todo)
+            qry = session.query(BioPortIdRecord.bioport_id, BioPortIdRecord.redirect_to)
+            for bioport_id, redirect_to in qry.filter(BioPortIdRecord.bioport_id.in_(todo)):
+                redirects[bioport_id] = redirect_to
+            canonical_ids = set(todo)
+            qry = session.query(PersonCluster.canonical_id).filter(PersonCluster.bioport_id.in_(todo))
+            canonical_ids.update([r[0] for r in qry])
+            qry = session.query(PersonCluster.bioport_id).filter(PersonCluster.canonical_id.in_(list(canonical_ids)))
+            found = set([r[0] for r in qry])
+            found.update(canonical_ids)
+            found.update([redirects.get(bioport_id) for bioport_id in todo])
+            found.discard(None)
+            todo = found - affected
+
+        session.query(PersonCluster).filter(PersonCluster.bioport_id.in_(list(affected))).delete(synchronize_session=False)
+        clusters = self._clusters(redirects, affected)
+        rows = []
+        for canonical_id, members in clusters.items():
+            rows += [dict(bioport_id=bioport_id, canonical_id=canonical_id) for bioport_id in members]
+        if rows:
+            session.execute(PersonCluster.__table__.insert(), rows)
+
+    def _clusters(self, redirects, bioport_ids):
+        """group bioport_ids by the end of their redirection chains
+
+        arguments:
+            redirects: a dictionary that maps bioport ids to the id they redirect to (or None)
+            bioport_ids: the ids to group
+        returns:
+            a dictionary that maps canonical ids to the sets of their members
+            (only for clusters with more than one member)
+        """
+        clusters = {}
+        for bioport_id in bioport_ids:
+            chain = [bioport_id]
+            while redirects.get(chain[-1]) and redirects[chain[-1]] not in chain:
+                chain.append(redirects[chain[-1]])
+            clusters.setdefault(chain[-1], set()).add(bioport_id)
+        for canonical_id, members in clusters.items():
+            members.add(canonical_id)
+            if len(members) == 1:
+                del clusters[canonical_id]
+        return clusters
+
+    def rebuild_person_clusters(self):
+        """fill the person_cluster table from scratch with the redirections in the bioportid table
+
+        the person_cluster table is created if it does not exist yet
+        (see datamanipulation/upgrade.py)
+        """
+        PersonCluster.__table__.create(bind=self.engine, checkfirst=True)
+        with self.get_session_context() as session:
+            session.query(PersonCluster).delete()
+            qry = session.query(BioPortIdRecord.bioport_id, BioPortIdRecord.redirect_to)
+            qry = qry.filter(BioPortIdRecord.redirect_to != None)  # @IgnorePep8
+            redirects = dict(qry.all())
+            rows = []
+            for canonical_id, members in self._clusters(redirects, redirects.keys()).items():
+                rows += [dict(bioport_id=bioport_id, canonical_id=canonical_id) for bioport_id in members]
+                if len(rows) > 1000:
+                    session.execute(PersonCluster.__table__.insert(), rows)
+                    rows = []
+            if rows:
+                session.execute(PersonCluster.__table__.insert(), rows)
+        self.invalidate_person_caches()
+
     def defer_identification(self, person1, person2):
         """register the fact that the user puts this pair at the "deferred  list """
         id1, id2 = person1.get_bioport_id(), person2.get_bioport_id()
@@ -2059,6 +3018,8 @@ class PersonList(object):
         a repository instance
         a list of bioport_ids
     """
+    BATCH_SIZE = 500  # the number of person records that are loaded at once when iterating
+
     def __init__(self, repository, bioport_ids):
         """
         arguments:
@@ -2073,6 +3034,10 @@ class PersonList(object):
     def __len__(self):
         return len(self._bioport_ids)
 
+    def get_bioport_ids(self):
+        """return the bioport_ids of the persons in the list (without loading the persons)"""
+        return list(self._bioport_ids)
+
     def __getitem__(self, key):
         if isinstance(key, slice):
             new_list = PersonList(self.repository, self._bioport_ids[key])
@@ -2080,3 +3045,16 @@ class PersonList(object):
 
         i = int(key)
         return self.repository.get_person(self._bioport_ids[i])
+
+    def __iter__(self):
+        """iterate over the persons, loading their records BATCH_SIZE at a time"""
+        for i in range(0, len(self._bioport_ids), self.BATCH_SIZE):
+            bioport_ids = self._bioport_ids[i:i + self.BATCH_SIZE]
+            records = self.repository.db.get_person_records(bioport_ids)
+            for bioport_id in bioport_ids:
+                record = records.get(bioport_id)
+                if record is None:
+                    # the person may have been redirected to another one
+                    yield self.repository.get_person(bioport_id)
+                else:
+                    yield Person(bioport_id=bioport_id, repository=self.repository, record=record)
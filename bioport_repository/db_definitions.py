@@ -199,6 +199,42 @@ class PersonName(Base):
     is_from_family_name = Column(Boolean)
 
 
+class PersonBrowse(Base):
+    """an index of the visible persons, for browsing them by initial and by category in the order of their sort_key
+
+    each visible person has a row for each combination of (its initial or u'') and (one of its categories or 0),
+    where u'' and 0 stand for 'all initials' and 'all categories'
+    """
+    __tablename__ = 'person_browse'
+    initial = Column(MSString(1), primary_key=True, autoincrement=False)
+    category_id = Column(Integer, primary_key=True, autoincrement=False)
+    sort_key = Column(MSString(50), primary_key=True)
+    bioport_id = Column(Integer, ForeignKey('person.bioport_id'), primary_key=True, autoincrement=False, index=True)
+
+
+class PersonDecade(Base):
+    """an index of the decades in which a person was certainly alive
+
+    a person has a row for each decade that overlaps the interval from geboortedatum_max to sterfdatum_min
+    (decade 178 stands for the years 1780-1789)
+    """
+    __tablename__ = 'person_decade'
+    bioport_id = Column(Integer, ForeignKey('person.bioport_id'), primary_key=True, autoincrement=False)
+    decade = Column(Integer, primary_key=True, autoincrement=False, index=True)
+
+
+class PersonCluster(Base):
+    """the clusters of bioport ids that have been identified (i.e. that represent the same person)
+
+    each member of a cluster has a row that points to the canonical bioport_id of the cluster
+    (the one at the end of the redirections), including the canonical id itself.
+    bioport ids that have not been identified with others have no row.
+    """
+    __tablename__ = 'person_cluster'
+    bioport_id = Column(Integer, primary_key=True, autoincrement=False)
+    canonical_id = Column(Integer, nullable=False, index=True)
+
+
 class PersonSource(Base):
     __tablename__ = 'person_source'
     bioport_id = Column(Integer, ForeignKey('person.bioport_id'), primary_key=True)
@@ -0,0 +1,183 @@
+##########################################################################
+# Copyright (C) 2009 - 2014 Huygens ING & Gerbrandy S.R.L.
+#
+# This file is part of bioport.
+#
+# bioport is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public
+# License along with this program.  If not, see
+# <http://www.gnu.org/licenses/gpl-3.0.html>.
+##########################################################################
+
+"""Download illustrations with a pool of threads
+
+Downloading illustrations is mostly waiting for remote servers, so we download several at once.
+The number of simultaneous downloads from the same host is limited, and downloads over http
+that fail because of transient errors (network errors, server errors) are retried a few times
+(waiting a bit longer each time).
+"""
+
+import time
+import Queue
+import logging
+import threading
+import urlparse
+
+from bioport_repository.illustration import CantDownloadImage, logexception
+
+
+class DownloadReport(object):
+    """Keeps count of the results of downloading illustrations
+
+    For backwards compatibility, a report can be unpacked as a tuple (total, skipped)
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.total = 0  # the number of biographies whose illustrations were downloaded
+        self.illustrations = 0  # the number of (different) illustrations
+        self.downloaded = 0
+        self.failed = 0
+        self.retries = 0
+        self.errors = []  # a list of (url, error message) tuples
+        self.started = time.time()
+
+    def __iter__(self):
+        return iter((self.total, self.skipped))
+
+    def __repr__(self):
+        return '<DownloadReport: %s illustrations, %s downloaded, %s failed, %s retries in %.1f seconds>' % (
+            self.illustrations, self.downloaded, self.failed, self.retries, self.elapsed)
+
+    @property
+    def skipped(self):
+        return self.failed
+
+    @property
+    def elapsed(self):
+        return time.time() - self.started
+
+    def add_success(self, illustration):
+        with self._lock:
+            self.downloaded += 1
+            done = self.downloaded + self.failed
+        if done % 100 == 0:
+            logging.info('[%s/%s] illustrations downloaded' % (done, self.illustrations))
+
+    def add_failure(self, illustration, error):
+        with self._lock:
+            self.failed += 1
+            self.errors.append((illustration.source_url, error))
+        logging.warning("Can't download image: %s" % error)
+
+    def add_retry(self):
+        with self._lock:
+            self.retries += 1
+
+
+class IllustrationDownloader(object):
+    """Downloads illustrations using a pool of threads"""
+
+    RETRY_SCHEMES = ['http', 'https']  # we only retry downloads over these protocols
+
+    def __init__(self, threads=8, per_host=2, retries=3, backoff=1.0):
+        """
+        arguments:
+            threads: the number of simultaneous downloads
+            per_host: the maximum number of simultaneous downloads from the same host
+            retries: how often a failed download is tried again
+            backoff: the number of seconds to wait before the first retry (this doubles with each retry)
+        """
+        self.threads = threads
+        self.per_host = per_host
+        self.retries = retries
+        self.backoff = backoff
+        self._hosts = {}
+        self._hosts_lock = threading.Lock()
+
+    def _host_semaphore(self, host):
+        with self._hosts_lock:
+            if host not in self._hosts:
+                self._hosts[host] = threading.Semaphore(self.per_host)
+            return self._hosts[host]
+
+    def download(self, illustrations, overwrite=False, report=None):
+        """download the illustrations
+
+        arguments:
+            illustrations: an iterable of Illustration instances
+            overwrite: if True, download the illustrations that we already have as well
+            report: a DownloadReport to add the results to
+        returns:
+            a DownloadReport
+        """
+        if report is None:
+            report = DownloadReport()
+        queue = Queue.Queue(maxsize=self.threads * 10)
+        workers = []
+        for _i in range(self.threads):
+            worker = threading.Thread(target=self._work, args=(queue, overwrite, report))
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+        seen = set()
+        try:
+            for illustration in illustrations:
+                # different biographies can have the same illustration
+                if illustration.id in seen:
+                    continue
+                seen.add(illustration.id)
+                report.illustrations += 1
+                queue.put(illustration)
+        finally:
+            for _worker in workers:
+                queue.put(None)
+            for worker in workers:
+                worker.join()
+        return report
+
+    def _work(self, queue, overwrite, report):
+        while True:
+            illustration = queue.get()
+            if illustration is None:
+                break
+            try:
+                self._download(illustration, overwrite, report)
+            except Exception, error:
+                # we do not want to lose the thread
+                logexception()
+                report.add_failure(illustration, str(error))
+
+    def _download(self, illustration, overwrite, report):
+        url = illustration.source_url
+        scheme, host = urlparse.urlparse(url)[:2]
+        if scheme in self.RETRY_SCHEMES:
+            retries = self.retries
+        else:
+            retries = 0
+        attempt = 0
+        while True:
+            with self._host_semaphore(host):
+                try:
+                    illustration.download(overwrite=overwrite)
+                except CantDownloadImage, error:
+                    pass
+                else:
+                    report.add_success(illustration)
+                    return
+            if attempt >= retries or not error.transient:
+                # trying again will not help (a 404, for example, or an invalid image)
+                report.add_failure(illustration, str(error))
+                return
+            report.add_retry()
+            time.sleep(self.backoff * 2 ** attempt)
+            attempt += 1
@@ -0,0 +1,97 @@
+##########################################################################
+# Copyright (C) 2009 - 2014 Huygens ING & Gerbrandy S.R.L.
+#
+# This file is part of bioport.
+#
+# bioport is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public
+# License along with this program.  If not, see
+# <http://www.gnu.org/licenses/gpl-3.0.html>.
+##########################################################################
+
+"""Export all persons as newline delimited JSON or as BioDes documents
+
+The persons are read in batches in the order of their sort_key (cf. DBRepository.get_persons_after),
+and the biographies of each batch are loaded with a single query, so that exporting all persons
+takes a constant amount of memory.
+
+Usage:
+
+    exporter = PersonExporter(repository)
+    with open('persons.json', 'w') as f:
+        exporter.export_json(f)
+"""
+
+import logging
+
+import simplejson
+
+from bioport_repository.merged_biography import MergedBiography
+
+
+class PersonExporter(object):
+    """Writes the merged biographies of persons to a file"""
+
+    def __init__(self, repository, batch_size=500):
+        """
+        arguments:
+            repository: a Repository instance
+            batch_size: the number of persons that are read at once
+        """
+        self.repository = repository
+        self.batch_size = batch_size
+
+    def iter_merged_biographies(self, **args):
+        """iterate over the MergedBiography instances of all persons satisfying args (cf. get_persons)"""
+        db = self.repository.db
+        after = None
+        n = 0
+        while True:
+            persons, after = db.get_persons_after(after=after, size=self.batch_size, **args)
+            bioport_ids = persons.get_bioport_ids()
+            biographies = db.get_biographies_of_persons(bioport_ids)
+            for bioport_id in bioport_ids:
+                bios = biographies.get(bioport_id)
+                if bios:
+                    yield MergedBiography(bios)
+                else:
+                    logging.warning('No biographies found for person %s' % bioport_id)
+            n += len(bioport_ids)
+            logging.info('exported %s persons' % n)
+            if after is None:
+                break
+
+    def export_json(self, out, **args):
+        """write the persons satisfying args to the file-like object out as JSON, one person per line
+
+        returns:
+            the number of persons written
+        """
+        n = 0
+        for merged_biography in self.iter_merged_biographies(**args):
+            out.write(simplejson.dumps(merged_biography.to_dict()))
+            out.write('\n')
+            n += 1
+        return n
+
+    def export_xml(self, out, **args):
+        """write the persons satisfying args to the file-like object out as BioDes documents, one after the other
+
+        returns:
+            the number of persons written
+        """
+        n = 0
+        for merged_biography in self.iter_merged_biographies(**args):
+            out.write(merged_biography.to_string())
+            out.write('\n')
+            n += 1
+        return n
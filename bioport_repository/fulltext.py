@@ -0,0 +1,168 @@
+##########################################################################
+# Copyright (C) 2009 - 2014 Huygens ING & Gerbrandy S.R.L.
+#
+# This file is part of bioport.
+#
+# bioport is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public
+# License along with this program.  If not, see
+# <http://www.gnu.org/licenses/gpl-3.0.html>.
+##########################################################################
+
+"""Full-text search on the search_source of persons
+
+The full-text search is delegated to a FullTextIndex, so that it does not depend on
+the full-text capabilities of MySQL. Which index is used depends on the database:
+
+    - MySQLFullTextIndex uses MATCH ... AGAINST on person.search_source
+    - SQLiteFullTextIndex keeps an FTS5 table that is updated by Person.save
+    - LikeFullTextIndex uses LIKE, and works everywhere (but slowly)
+"""
+
+import abc
+import re
+
+import sqlalchemy
+from sqlalchemy import DDL, event, Integer, Float, desc
+from sqlalchemy.sql.expression import false
+
+from bioport_repository.db_definitions import PersonRecord
+
+FTS_TABLE = 'person_fulltext'
+
+# create (and drop) the fts table together with the person table
+event.listen(PersonRecord.__table__, 'after_create', DDL(
+    'CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5(bioport_id UNINDEXED, search_source)' % FTS_TABLE,
+    ).execute_if(dialect='sqlite'))
+event.listen(PersonRecord.__table__, 'before_drop', DDL(
+    'DROP TABLE IF EXISTS %s' % FTS_TABLE,
+    ).execute_if(dialect='sqlite'))
+
+
+def search_words(search_term):
+    """split the search term in words"""
+    return [word for word in re.split(r'\W+', search_term, flags=re.UNICODE) if word]
+
+
+class FullTextIndex(object):
+    """Base class for full-text indexes (subclasses must implement filter)"""
+    __metaclass__ = abc.ABCMeta
+
+    def __init__(self, db):
+        self.db = db
+
+    def update(self, session, bioport_id, search_source):
+        """(re)index the search_source of the person with this bioport_id"""
+
+    def remove(self, session, bioport_id):
+        """remove the person with this bioport_id from the index"""
+
+    @abc.abstractmethod
+    def filter(self, qry, search_term, rank=False):
+        """filter the query for persons that have all words of search_term in their search_source
+
+        if search_term has no words (e.g. it is only punctuation), nothing is found
+
+        arguments:
+            qry : a sqlalchemy Query instance
+            search_term : a string
+            rank : if True, order the results by relevance
+        returns:
+            a Query instance
+        """
+
+    def highlight(self, text, search_term):
+        """return the positions of the words of search_term in text
+
+        returns:
+            a list of (start, end) tuples
+        """
+        words = search_words(search_term)
+        if not words or not text:
+            return []
+        regexp = re.compile(r'\b(%s)\b' % '|'.join([re.escape(word) for word in words]), re.IGNORECASE | re.UNICODE)
+        return [match.span() for match in regexp.finditer(text)]
+
+
+class MySQLFullTextIndex(FullTextIndex):
+    """use the MySQL full text search on person.search_source
+
+    (there is nothing to maintain, as Person.save already fills search_source)
+    """
+
+    def filter(self, qry, search_term, rank=False):
+        words = search_words(search_term)
+        if not words:
+            return qry.filter(false())
+        # Mysql uses the OR operator by default
+        # with a '+' in front of each word we use the AND operator
+        words_query = u' '.join([u'+' + word for word in words])
+        match = sqlalchemy.text('MATCH (person.search_source) AGAINST (:words_query IN BOOLEAN MODE)')
+        match = match.bindparams(words_query=words_query)
+        qry = qry.filter(match)
+        if rank:
+            qry = qry.order_by(desc(match))
+        return qry
+
+
+class SQLiteFullTextIndex(FullTextIndex):
+    """keep the search_source of the persons in an sqlite FTS5 table"""
+
+    def update(self, session, bioport_id, search_source):
+        self.remove(session, bioport_id)
+        session.execute(
+            'INSERT INTO %s (bioport_id, search_source) VALUES (:bioport_id, :search_source)' % FTS_TABLE,
+            dict(bioport_id=bioport_id, search_source=search_source or u''),
+            )
+
+    def remove(self, session, bioport_id):
+        session.execute('DELETE FROM %s WHERE bioport_id = :bioport_id' % FTS_TABLE, dict(bioport_id=bioport_id))
+
+    def filter(self, qry, search_term, rank=False):
+        words = search_words(search_term)
+        if not words:
+            # (an empty MATCH is a syntax error in FTS5)
+            return qry.filter(false())
+        # quote all words, so they are not interpreted as FTS5 operators
+        fts_query = u' AND '.join([u'"%s"' % word for word in words])
+        matches = sqlalchemy.text(
+            'SELECT bioport_id, bm25(%s) AS score FROM %s WHERE %s MATCH :fts_query' % (FTS_TABLE, FTS_TABLE, FTS_TABLE)
+            ).bindparams(fts_query=fts_query)
+        matches = matches.columns(bioport_id=Integer, score=Float).alias('fulltext_matches')
+        qry = qry.join((matches, matches.c.bioport_id == PersonRecord.bioport_id))
+        if rank:
+            # bm25 gives lower scores to better matches
+            qry = qry.order_by(matches.c.score)
+        return qry
+
+
+class LikeFullTextIndex(FullTextIndex):
+    """search in person.search_source with LIKE (this works in any database)"""
+
+    def filter(self, qry, search_term, rank=False):
+        words = search_words(search_term)
+        if not words:
+            return qry.filter(false())
+        for word in words:
+            qry = qry.filter(PersonRecord.search_source.like(u'%' + word + u'%'))
+        return qry
+
+
+def get_fulltext_index(db):
+    """return the FullTextIndex to use with the database of db (a DBRepository instance)"""
+    dialect = db.engine.dialect.name
+    if dialect == 'mysql':
+        return MySQLFullTextIndex(db)
+    elif dialect == 'sqlite':
+        return SQLiteFullTextIndex(db)
+    else:
+        return LikeFullTextIndex(db)
@@ -21,15 +21,23 @@
 from __future__ import with_statement
 
 import os
+import errno
 import urllib2
 import httplib
 import traceback
 import sys
 import logging
-from hashlib import md5
+import shutil
+import socket
+import tempfile
+import threading
+import time
+from hashlib import md5, sha1
 import simplejson
 from gerbrandyutils import normalize_url
 
+from bioport_repository.common import LRUCache
+
 try:
     from PIL import Image
 except ImportError:
@@ -41,10 +49,110 @@ sys.modules['PIL.Image'] = Image
 MEDIUM_THUMB_SIZE = (200, 200)
 SMALL_THUMB_SIZE = (100, 100)
 HOME_THUMB_SIZE = (300, 300)
+THUMB_SIZES = [MEDIUM_THUMB_SIZE, SMALL_THUMB_SIZE, HOME_THUMB_SIZE]
+THUMBNAIL_QUALITY = 88
+
+MAX_IMAGE_SIZE = 100 * 1024 * 1024  # we do not download images larger than this (in bytes)
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+
+def thumbnail_basename(basename, width, height):
+    """return the name of the file of the thumbnail of size (width, height) of the image in the file basename"""
+    return "%sx%s_%s" % (width, height, basename)
+
+
+def _link(source, target):
+    """make target a hard link to source (or a copy, if we cannot link), replacing target atomically"""
+    # a name of our own, as other threads (or processes) may be linking to the same target
+    fd, temp_target = tempfile.mkstemp(dir=os.path.dirname(target), prefix='.link_')
+    os.close(fd)
+    try:
+        os.remove(temp_target)
+        try:
+            os.link(source, temp_target)
+        except (OSError, AttributeError):
+            # the file system (or the os) does not support hard links
+            shutil.copyfile(source, temp_target)
+        os.rename(temp_target, target)
+    except:
+        if os.path.exists(temp_target):
+            os.remove(temp_target)
+        raise
+
+
+def _link_new(source, target):
+    """make target a hard link to source (or a copy, if we cannot link), unless target exists already
+
+    returns:
+        True if we created target, False if it existed already
+    """
+    try:
+        os.link(source, target)
+        return True
+    except OSError, err:
+        if err.errno == errno.EEXIST:
+            # someone else (possibly another thread, just now) was first
+            return False
+    except AttributeError:
+        pass
+    # the file system (or the os) does not support hard links
+    if os.path.exists(target):
+        return False
+    _link(source, target)
+    return True
+
+
+def create_thumbnails(source, thumbnails):
+    """Create thumbnails of the image in the file source
+
+    The image is decoded only once (and JPEG images are scaled down while decoding).
+    Each thumbnail is made from the previous (larger) one, where possible.
+    Inspired from Products.Archetypes.Field
+
+    arguments:
+        source: the path of an image file
+        thumbnails: a list of tuples ((width, height), filename) - the thumbnail of
+            the image that fits in the rectangle (width, height) is saved as a JPEG image in filename
+    """
+    # PIL stuff
+    pilfilter = 0  # NEAREST
+    if Image.VERSION >= "1.1.3":  # @UndefinedVariable
+        pilfilter = 1  # ANTIALIAS
+
+    # we start with the largest thumbnail
+    thumbnails = sorted(thumbnails, key=lambda t: t[0][0] * t[0][1], reverse=True)
+    original = Image.open(source)  # @UndefinedVariable
+    # let the JPEG decoder scale down the image to (not less than) the largest size
+    # (this is a no-op for other formats)
+    original.draft('RGB', thumbnails[0][0])
+    original = original.convert('RGB')
+
+    previous_size = None
+    for (width, height), filename in thumbnails:
+        if previous_size is None or width > previous_size[0] or height > previous_size[1]:
+            # the previous thumbnail may be too small for this one
+            image = original.copy()
+        image.thumbnail((width, height), pilfilter)
+        image.save(filename, "JPEG", quality=THUMBNAIL_QUALITY)
+        previous_size = (width, height)
 
 
 class CantDownloadImage(Exception):
-    """Raised by download() when it can't download the image from an external url"""
+    """Raised by download() when it can't download the image from an external url
+
+    status is the HTTP status code of the response (if there was one), and transient is True
+    if the error may go away by itself (such as network errors and server errors), so
+    that it makes sense to try again later
+    """
+
+    def __init__(self, msg, status=None, transient=False):
+        Exception.__init__(self, msg)
+        self.status = status
+        self.transient = transient
+
+
+# the HTTP status codes of errors that may go away by themselves (besides the 5xx errors)
+TRANSIENT_HTTP_STATUS = [408, 429]
 
 
 def logexception():
@@ -53,9 +161,111 @@ def logexception():
     logging.error(msg)
 
 
+# the directories that we know exist (so we do not have to check again)
+_ensured_directories = set()
+
+
+def ensure_directory(directory, cached=True):
+    """create directory if it does not exist yet
+
+    arguments:
+        cached: if True, the file system is checked only the first time we see a directory
+    """
+    if cached and directory in _ensured_directories:
+        return
+    if not os.path.isdir(directory):
+        try:
+            os.mkdir(directory)
+        except OSError:
+            # another process may have created it in the meantime
+            if not os.path.isdir(directory):
+                raise
+    _ensured_directories.add(directory)
+
+
+class ThumbnailIndex(object):
+    """An in-memory index of the files in the thumbnails directory
+
+    With this index, we can tell if a thumbnail exists without asking the file system.
+    The directory is read once (and again when refresh() is called), and the index is
+    updated when we create or remove thumbnails. To find the thumbnails created by other
+    processes, we look for a thumbnail that is not in the index on disk, and then remember
+    for MISS_TTL seconds that it does not exist.
+    """
+
+    MISS_TTL = 600
+    MISS_CACHE_SIZE = 100000
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._filenames = None
+        self._misses = LRUCache(maxsize=self.MISS_CACHE_SIZE)  # basename -> the time we found it did not exist
+
+    def refresh(self):
+        """read the list of thumbnails from disk"""
+        if os.path.isdir(self.directory):
+            filenames = set(os.listdir(self.directory))
+        else:
+            filenames = set()
+        with self._lock:
+            self._filenames = filenames
+            self._misses = LRUCache(maxsize=self.MISS_CACHE_SIZE)
+
+    def __contains__(self, basename):
+        if self._filenames is None:
+            self.refresh()
+        if basename in self._filenames:
+            return True
+        now = time.time()
+        missed = self._misses.get(basename)
+        if missed is not None and now - missed < self.MISS_TTL:
+            return False
+        if os.path.isfile(os.path.join(self.directory, basename)):
+            # it was created by another process
+            self.add(basename)
+            return True
+        self._misses.set(basename, now)
+        return False
+
+    def add(self, basename):
+        with self._lock:
+            if self._filenames is not None:
+                self._filenames.add(basename)
+            self._misses.remove(basename)
+
+    def discard(self, basename):
+        with self._lock:
+            if self._filenames is not None:
+                self._filenames.discard(basename)
+
+
+# maps the path of images_cache_local to the ThumbnailIndex of its thumbnails directory
+_thumbnail_indexes = {}
+
+
+def clear_image_caches():
+    """forget which directories and thumbnails exist (e.g. after removing the image cache)"""
+    _ensured_directories.clear()
+    _thumbnail_indexes.clear()
+
+
+def get_thumbnail_index(images_cache_local):
+    """return the ThumbnailIndex of the thumbnails in images_cache_local"""
+    directory = os.path.join(images_cache_local, 'thumbnails')
+    try:
+        return _thumbnail_indexes[directory]
+    except KeyError:
+        return _thumbnail_indexes.setdefault(directory, ThumbnailIndex(directory))
+
+
 class Illustration:
     """XXX - needs docstring"""
 
+    # if True, identical images (from different urls) are stored only once, in the 'content' directory,
+    # and cached_local and the thumbnails are (hard) links to these
+    CONTENT_ADDRESSED = False
+
     def __init__(self, url,
            images_cache_local,
            images_cache_url,
@@ -74,21 +284,22 @@ class Illustration:
         self._url = url
         self._images_cache_local = images_cache_local and unicode(images_cache_local) or u''
         self._thumbnails_directory = os.path.join(self._images_cache_local, 'thumbnails')
-        if not os.path.isdir(self._thumbnails_directory):
-            try:
-                os.mkdir(self._thumbnails_directory)
-            except OSError:
-                if not os.path.exists(self._images_cache_local):
-                    msg = 'The path at {self._images_cache_local} does not exist.'.format(self=self)
-                    msg += 'Check the setting for IMAGES_CACHE_LOCAL on the page /admin/edit '
-                    raise OSError(msg)
-                else:
-                    raise
+        try:
+            ensure_directory(self._thumbnails_directory)
+        except OSError:
+            if not os.path.exists(self._images_cache_local):
+                msg = 'The path at {self._images_cache_local} does not exist.'.format(self=self)
+                msg += 'Check the setting for IMAGES_CACHE_LOCAL on the page /admin/edit '
+                raise OSError(msg)
+            else:
+                raise
         self._images_cache_url = images_cache_url or u''
         self._prefix = prefix
         self._link_url = link_url
         self._caption = caption
         self._id = self._create_id()
+        self.checksum = None  # the checksum of the image (set when it is downloaded)
+        self.size = None
 
     # --- public API used by the view
     @property
@@ -185,68 +396,227 @@ class Illustration:
         else:
             url = normalize_url(self.source_url)
             logging.info('Downloading image from %s to %s' % (repr(url), repr(self.cached_local)))
+            request = urllib2.Request(url)
+            metadata = self.get_metadata()
+            # if we have a (valid) copy of the image already, we are refreshing it
+            refreshing = bool(metadata and self.has_image())
+            if refreshing:
+                # ask the server to send the image only if it has changed
+                if metadata.get('etag'):
+                    request.add_header('If-None-Match', metadata['etag'])
+                if metadata.get('last_modified'):
+                    request.add_header('If-Modified-Since', metadata['last_modified'])
             try:
-                http = urllib2.urlopen(url)
-            except (urllib2.HTTPError, OSError, UnicodeEncodeError, httplib.BadStatusLine, urllib2.URLError), err:
-                if os.path.isfile(self.cached_local):
+                http = urllib2.urlopen(request)
+            except urllib2.HTTPError, err:
+                if err.code == 304:
+                    logging.info('image at %s has not been modified' % repr(url))
+                    http = None
+                else:
+                    if not refreshing and os.path.isfile(self.cached_local):
+                        os.remove(self.cached_local)
+                    transient = err.code >= 500 or err.code in TRANSIENT_HTTP_STATUS
+                    raise CantDownloadImage(str(err), status=err.code, transient=transient)
+            except (httplib.BadStatusLine, urllib2.URLError, socket.error), err:
+                # network trouble (if we are refreshing the image, we keep the copy that we have)
+                if not refreshing and os.path.isfile(self.cached_local):
                     os.remove(self.cached_local)
-                raise CantDownloadImage(str(err))
-
-            # write main image file on disk
-            try:
-                with open(self.cached_local, 'w') as f:
-                    f.write(http.read())
-                http.close()
-            except:
-                if os.path.isfile(self.cached_local):
+                raise CantDownloadImage(str(err), transient=True)
+            except (OSError, UnicodeEncodeError), err:
+                if not refreshing and os.path.isfile(self.cached_local):
                     os.remove(self.cached_local)
-                raise
+                raise CantDownloadImage(str(err))
 
-        # write two smaller thumbs on disk
+            if http is not None:
+                # write main image file on disk
+                # (if we are refreshing and the image has not changed, we keep the file we have,
+                # so that its modification time still tells that the thumbnails are up to date)
+                try:
+                    self._save_stream(http, keep_checksum=refreshing and metadata.get('checksum') or None)
+                finally:
+                    http.close()
+                if not metadata or metadata.get('checksum') != self.checksum:
+                    # the image has changed, so the thumbnails are out of date
+                    self._remove_thumbnails()
+                self._save_metadata(http.info())
+                if self.CONTENT_ADDRESSED:
+                    self._store_content()
+
+        # write the smaller thumbs on disk
         try:
-            self._create_thumbnail(*MEDIUM_THUMB_SIZE)
-            self._create_thumbnail(*SMALL_THUMB_SIZE)
-            self._create_thumbnail(*HOME_THUMB_SIZE)
+            self.create_thumbnails()
         except IOError, err:
             os.remove(self.cached_local)  # why??
             raise CantDownloadImage(str(err))
-        except:
+        except Exception, err:
             logexception()
             os.remove(self.cached_local)
             raise CantDownloadImage(str(err))
 
-    def _create_thumbnail(self, width, height):
+    def _save_stream(self, http, keep_checksum=None):
+        """write the data from the file-like object http to cached_local
+
+        The data are written in chunks to a temporary file, which replaces cached_local
+        only when all data have been read (so we never see a half-written image).
+        The checksum and the size of the image are stored in self.checksum and self.size
+
+        arguments:
+            http: a file-like object
+            keep_checksum: the checksum of the existing cached_local: if the data have this
+                checksum, the existing file is left alone
         """
-        Create a thumbnail of the image and store a local copy
-        width and height are sizes in pixels - the image should fit within
-        the rectangle defined by these sizes.
-        inspired from Products.Archetypes.Field
+        length = http.info().get('Content-Length')
+        if length and int(length) > MAX_IMAGE_SIZE:
+            raise CantDownloadImage('The image at %s is too large (%s bytes)' % (self.source_url, length))
+        fd, temp_filename = tempfile.mkstemp(dir=self.images_directory, prefix='.download_')
+        try:
+            checksum = sha1()
+            size = 0
+            with os.fdopen(fd, 'wb') as f:
+                while True:
+                    try:
+                        chunk = http.read(DOWNLOAD_CHUNK_SIZE)
+                    except (socket.error, httplib.HTTPException), err:
+                        raise CantDownloadImage('The download of %s failed: %s' % (self.source_url, err), transient=True)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > MAX_IMAGE_SIZE:
+                        raise CantDownloadImage('The image at %s is too large (more than %s bytes)' % (self.source_url, MAX_IMAGE_SIZE))
+                    checksum.update(chunk)
+                    f.write(chunk)
+            if length and size != int(length):
+                raise CantDownloadImage('The download of %s is incomplete (%s of %s bytes)' % (self.source_url, size, length), transient=True)
+            if keep_checksum and checksum.hexdigest() == keep_checksum and os.path.isfile(self.cached_local):
+                os.remove(temp_filename)
+            else:
+                # mkstemp creates files that only we can read
+                os.chmod(temp_filename, 0644)
+                os.rename(temp_filename, self.cached_local)
+        except:
+            if os.path.exists(temp_filename):
+                os.remove(temp_filename)
+            raise
+        self.checksum = checksum.hexdigest()
+        self.size = size
+
+    @property
+    def metadata_filename(self):
+        """the path of the file with the metadata of the local copy of the image"""
+        return os.path.join(self._images_cache_local, 'metadata', self.id + u'.json').encode('utf8')
+
+    def get_metadata(self):
+        """return a dictionary with the url, etag, last_modified, size and checksum of the local copy of the image
+
+        returns None if there is no (valid) metadata, or the metadata are of an image with a different url
+        """
+        try:
+            with open(self.metadata_filename) as f:
+                metadata = simplejson.load(f)
+        except (IOError, ValueError):
+            return None
+        if metadata.get('url') != self.source_url:
+            return None
+        return metadata
+
+    def _save_metadata(self, headers):
+        """store the metadata of the downloaded image
+
+        arguments:
+            headers: the headers of the http response
+        """
+        metadata = dict(
+            url=self.source_url,
+            etag=headers.get('ETag'),
+            last_modified=headers.get('Last-Modified'),
+            size=self.size,
+            checksum=self.checksum,
+            )
+        directory = os.path.dirname(self.metadata_filename)
+        ensure_directory(directory, cached=False)
+        with open(self.metadata_filename, 'w') as f:
+            simplejson.dump(metadata, f)
+
+    def _thumbnail_filename(self, width, height):
+        """the path of the thumbnail of the image of this size"""
+        return os.path.join(self.thumbnails_directory, thumbnail_basename(os.path.basename(self.cached_local), width, height))
+
+    def _remove_thumbnails(self):
+        index = get_thumbnail_index(self._images_cache_local)
+        for width, height in THUMB_SIZES:
+            filename = self._thumbnail_filename(width, height)
+            if os.path.exists(filename):
+                os.remove(filename)
+            index.discard(os.path.basename(filename))
+
+    def create_thumbnails(self, sizes=THUMB_SIZES):
+        """Create the thumbnails of the image (of the given sizes) that do not exist yet
+
+        returns:
+            a list with the filenames of the thumbnails that were created
         """
-        assert isinstance(width, int)
-        assert isinstance(height, int)
         if not os.path.isfile(self.cached_local):
             raise ValueError("the original image does not exist (it was supposed to be found here: %s)"
                              % self.cached_local)
+        ensure_directory(self.thumbnails_directory, cached=False)
+        thumbnails = []
+        for width, height in sizes:
+            assert isinstance(width, int)
+            assert isinstance(height, int)
+            filename = self._thumbnail_filename(width, height)
+            if os.path.exists(filename):
+                logging.info('thumbnail already exists at %s - none created' % filename)
+            else:
+                thumbnails.append(((width, height), filename))
+        checksum = None
+        if self.CONTENT_ADDRESSED:
+            checksum = self.checksum or (self.get_metadata() or {}).get('checksum')
+        if checksum:
+            # use the thumbnails of an identical image, if we have these
+            to_create = []
+            for (width, height), filename in thumbnails:
+                content_filename = self._content_filename(thumbnail_basename(checksum, width, height))
+                try:
+                    _link(content_filename, filename)
+                except (OSError, IOError):
+                    # there is no such thumbnail (or it was just removed by thumbnails.remove_orphaned_content)
+                    to_create.append(((width, height), filename))
+            thumbnails = to_create
+        if thumbnails:
+            create_thumbnails(self.cached_local, thumbnails)
+            if checksum:
+                for (width, height), filename in thumbnails:
+                    _link_new(filename, self._content_filename(thumbnail_basename(checksum, width, height)))
+        index = get_thumbnail_index(self._images_cache_local)
+        for width, height in sizes:
+            index.add(os.path.basename(self._thumbnail_filename(width, height)))
+        return [filename for _size, filename in thumbnails]
+
+    def _content_filename(self, basename):
+        """the path of the file basename in the content directory"""
+        directory = os.path.join(self._images_cache_local, 'content').encode('utf8')
+        ensure_directory(directory, cached=False)
+        return os.path.join(directory, basename)
+
+    def _store_content(self):
+        """store the image under its checksum, or, if we have an identical image already, link to that one"""
+        content_filename = self._content_filename(self.checksum)
+        if not _link_new(self.cached_local, content_filename):
+            try:
+                _link(content_filename, self.cached_local)
+            except (OSError, IOError):
+                # the identical image was removed just now (cf. thumbnails.remove_orphaned_content)
+                _link_new(self.cached_local, content_filename)
 
-        basename = os.path.basename(self.cached_local)
-        basename = "%sx%s_%s" % (width, height, basename)
-        filename = os.path.join(self.thumbnails_directory, basename)
-        if os.path.exists(filename):
-            logging.info('thumbnail already exists at %s - none created' % filename)
-            return
-
-        # PIL stuff
-        pilfilter = 0  # NEAREST
-        if Image.VERSION >= "1.1.3":  # @UndefinedVariable
-            pilfilter = 1  # ANTIALIAS
-
-        image = Image.open(self.cached_local)  # @UndefinedVariable
-        image = image.convert('RGB')
-        image.thumbnail((width, height), pilfilter)
-
-        # write on disk
-        image.save(filename, "JPEG", quality=88)
-        return filename
+    def _create_thumbnail(self, width, height):
+        """
+        Create a thumbnail of the image and store a local copy
+        width and height are sizes in pixels - the image should fit within
+        the rectangle defined by these sizes.
+        """
+        filenames = self.create_thumbnails(sizes=[(width, height)])
+        if filenames:
+            return filenames[0]
 
     def _create_id(self):
         # XXX - IMPORTANT
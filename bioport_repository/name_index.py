@@ -0,0 +1,191 @@
+##########################################################################
+# Copyright (C) 2009 - 2014 Huygens ING & Gerbrandy S.R.L.
+#
+# This file is part of bioport.
+#
+# bioport is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public
+# License along with this program.  If not, see
+# <http://www.gnu.org/licenses/gpl-3.0.html>.
+##########################################################################
+
+"""An in-memory inverted index of the tokens in the person_name table
+
+Searching for an exact name with N words means joining person_name N times.
+The NameIndex keeps, for each name token, a sorted array of the bioport_ids
+of the persons with that token, so that searching for several words is an
+intersection of sorted lists, and searching with wildcards a scan over a
+range of the sorted list of tokens.
+"""
+
+import re
+import time
+import threading
+import unicodedata
+from array import array
+from bisect import bisect_left, insort
+
+# the length of the name column of person_name
+MAX_TOKEN_LENGTH = 20
+
+
+def normalize_token(word):
+    """return the form of the word under which it is indexed
+
+    we mimic the (case and accent insensitive) collation of the database
+    """
+    word = unicode(word).lower()
+    word = unicodedata.normalize('NFKD', word)
+    return u''.join([c for c in word if not unicodedata.combining(c)])
+
+
+def intersect(ls1, ls2):
+    """return the intersection of two sorted sequences as a sorted array"""
+    result = array('l')
+    i, j = 0, 0
+    len1, len2 = len(ls1), len(ls2)
+    while i < len1 and j < len2:
+        if ls1[i] < ls2[j]:
+            i += 1
+        elif ls1[i] > ls2[j]:
+            j += 1
+        else:
+            result.append(ls1[i])
+            i += 1
+            j += 1
+    return result
+
+
+class NameIndex(object):
+    """Maps name tokens to sorted arrays of bioport_ids"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._postings = {}  # token -> array of bioport_ids
+        self._family_postings = {}  # token -> array of bioport_ids, for tokens from the family name
+        self._terms = []  # sorted list of all tokens
+        self._tokens_of_person = {}  # bioport_id -> list of (token, is_from_family_name)
+        self.timestamp = time.time()  # the time of the last complete build
+        self.refreshed = self.timestamp  # the time of the last (incremental) refresh
+        self.watermark = None  # can be used to remember up to where the index was refreshed
+
+    def __len__(self):
+        return len(self._terms)
+
+    def build(self, rows):
+        """fill the index
+
+        arguments:
+            rows: an iterable of (bioport_id, name, is_from_family_name) tuples
+        """
+        with self._lock:
+            postings = {}
+            family_postings = {}
+            tokens_of_person = {}
+            for bioport_id, name, is_from_family_name in rows:
+                token = normalize_token(name)[:MAX_TOKEN_LENGTH]
+                postings.setdefault(token, set()).add(bioport_id)
+                if is_from_family_name:
+                    family_postings.setdefault(token, set()).add(bioport_id)
+                tokens_of_person.setdefault(bioport_id, []).append((token, bool(is_from_family_name)))
+            self._postings = dict([(k, array('l', sorted(v))) for k, v in postings.items()])
+            self._family_postings = dict([(k, array('l', sorted(v))) for k, v in family_postings.items()])
+            self._terms = sorted(self._postings)
+            self._tokens_of_person = tokens_of_person
+            self.timestamp = self.refreshed = time.time()
+
+    def remove(self, bioport_id):
+        """remove all tokens of the person with this bioport_id from the index"""
+        with self._lock:
+            for token, is_from_family_name in self._tokens_of_person.pop(bioport_id, []):
+                self._remove_posting(self._postings, token, bioport_id)
+                if is_from_family_name:
+                    self._remove_posting(self._family_postings, token, bioport_id)
+                if token not in self._postings:
+                    i = bisect_left(self._terms, token)
+                    if i < len(self._terms) and self._terms[i] == token:
+                        del self._terms[i]
+
+    def update(self, bioport_id, tokens):
+        """replace the tokens of the person with this bioport_id
+
+        arguments:
+            tokens: a list of (name, is_from_family_name) tuples
+        """
+        with self._lock:
+            self.remove(bioport_id)
+            tokens = [(normalize_token(name)[:MAX_TOKEN_LENGTH], bool(is_from_family_name)) for name, is_from_family_name in tokens]
+            for token, is_from_family_name in tokens:
+                if token not in self._postings:
+                    insort(self._terms, token)
+                self._add_posting(self._postings, token, bioport_id)
+                if is_from_family_name:
+                    self._add_posting(self._family_postings, token, bioport_id)
+            self._tokens_of_person[bioport_id] = tokens
+
+    def _add_posting(self, postings, token, bioport_id):
+        ls = postings.setdefault(token, array('l'))
+        i = bisect_left(ls, bioport_id)
+        if i == len(ls) or ls[i] != bioport_id:
+            ls.insert(i, bioport_id)
+
+    def _remove_posting(self, postings, token, bioport_id):
+        ls = postings.get(token)
+        if ls is None:
+            return
+        i = bisect_left(ls, bioport_id)
+        if i < len(ls) and ls[i] == bioport_id:
+            del ls[i]
+        if not ls:
+            del postings[token]
+
+    def _lookup(self, word, family_name_only=False):
+        """return the sorted array of bioport_ids of persons that have word in their names
+
+        word may contain the wildcards '?' (any character) and '*' (any sequence of characters)
+        """
+        postings = family_name_only and self._family_postings or self._postings
+        word = normalize_token(word)
+        if '?' not in word and '*' not in word:
+            return postings.get(word, array('l'))
+
+        prefix = re.split(r'[?*]', word)[0]
+        pattern = u''.join([{u'?': u'.', u'*': u'.*'}.get(c, re.escape(c)) for c in word])
+        pattern = re.compile(pattern + u'$', re.UNICODE)
+        bioport_ids = set()
+        i = bisect_left(self._terms, prefix)
+        while i < len(self._terms) and self._terms[i].startswith(prefix):
+            term = self._terms[i]
+            if pattern.match(term) and term in postings:
+                bioport_ids.update(postings[term])
+            i += 1
+        return array('l', sorted(bioport_ids))
+
+    def search(self, words, family_name_only=False):
+        """return a sorted array of the bioport_ids of the persons that have all words in their names
+
+        arguments:
+            words: a list of strings (that may contain the wildcards '?' and '*')
+            family_name_only: if True, only consider tokens from the family name
+        """
+        with self._lock:
+            ls = [self._lookup(word, family_name_only=family_name_only) for word in words]
+        if not ls:
+            return array('l')
+        # start with the shortest list, to keep the intermediate results small
+        ls.sort(key=len)
+        result = array('l', ls[0])
+        for other in ls[1:]:
+            if not result:
+                break
+            result = intersect(result, other)
+        return result
@@ -29,6 +29,7 @@ from names.common import coerce_to_ascii
 from bioport_repository.merged_biography import MergedBiography, BiographyMerger
 from bioport_repository.db_definitions import STATUS_NEW, SOURCE_TYPE_PORTRAITS
 from bioport_repository.common import format_date, to_date
+from bioport_repository.illustration import get_thumbnail_index
 from bioport_repository.db_definitions import (
     RelPersonCategory,
     RelPersonReligion,
@@ -150,6 +151,7 @@ class Person(object):
             r_person.sort_key = computed_values.sort_key
             r_person.has_illustrations = computed_values.has_illustrations
             r_person.search_source = computed_values.search_source
+            self.repository.db.fulltext.update(session, bioport_id, r_person.search_source)
             r_person.sex = computed_values.sex
             r_person.geboortedatum_min = computed_values.geboortedatum_min
             r_person.geboortedatum_max = computed_values.geboortedatum_max
@@ -171,12 +173,18 @@ class Person(object):
                 date = to_date(r_person.geboortedatum_min[0:10])
                 iso = date.isoformat()
                 r_person.birthday = iso[5:7] + iso[8:10]
+            else:
+                r_person.birthday = None
 
             if r_person.sterfdatum_min is not None and r_person.sterfdatum_min == r_person.sterfdatum_max:
                 date = to_date(r_person.sterfdatum_min[0:10])
 #                 print 'date = %s' % date
                 iso = date.isoformat()
                 r_person.deathday = iso[5:7] + iso[8:10]
+            else:
+                r_person.deathday = None
+
+            self.repository.db.update_decade_index(session, r_person)
 
             #     initial = Column(MSString(1), index=True) # eerste letter van naam
             if r_person.has_name:
@@ -222,6 +230,7 @@ class Person(object):
                     done.append(category_id)
                     session.add(r)
                     session.flush()
+            self.repository.db.update_browse_index(session, r_person, done)
 
             # update the religion table
             religion = merged_biography.get_religion()
@@ -273,6 +282,7 @@ class Person(object):
         # XXX: these next two lines somehow guarantee that something does not break - find out why, what, and remove them
         with self.repository.db.get_session_context() as session:
             session.merge(self.record)
+        self.repository.db.invalidate_person_caches()
 
     def add_biography(self, biography, comment=None):
         biography.set_value('bioport_id', self.get_bioport_id())
@@ -453,13 +463,21 @@ class Person(object):
         elif url.startswith('http:'):
             return url
         else:
-            # we assume it is a filename
-            if os.path.isfile(os.path.join(self.repository.images_cache_local, self.record.thumbnail)):
+            # we assume it is a filename (relative to images_cache_local)
+            if self._thumbnail_exists(url):
                 images_cache_url = self.repository.images_cache_url
                 return '%s/%s' % (images_cache_url, self.record.thumbnail)
             else:
                 return None
 
+    def _thumbnail_exists(self, filename):
+        """return True if the thumbnail at filename (relative to images_cache_local) exists"""
+        directory, basename = os.path.split(filename)
+        if directory == 'thumbnails':
+            # look it up in the index, so we do not have to ask the file system
+            return basename in get_thumbnail_index(self.repository.images_cache_local)
+        return os.path.isfile(os.path.join(self.repository.images_cache_local, filename))
+
     def geslachtsnaam(self):
         return self.record.geslachtsnaam
 
@@ -34,11 +34,15 @@ from bioport_repository.db_definitions import STATUS_VALUES, RELIGION_VALUES
 from bioport_repository.db_definitions import SOURCE_TYPES
 from bioport_repository.biography import Biography
 from bioport_repository.db import DBRepository
+from bioport_repository.export import PersonExporter
 # from bioport_repository.person import Person
 from bioport_repository.repocommon import BioPortException
 from bioport_repository.source import BioPortSource, Source
 from bioport_repository.svn_repository import SVNRepository
-from bioport_repository.illustration import CantDownloadImage
+from bioport_repository.downloader import IllustrationDownloader, DownloadReport
+from bioport_repository.thumbnails import rebuild_thumbnails
+
+DOWNLOAD_THREADS = 8  # the number of illustrations that are downloaded simultaneously
 
 
 class Repository(object):
@@ -96,6 +100,34 @@ class Repository(object):
         """
         return self.db.get_persons(**args)
 
+    def get_persons_page(self, start=0, size=50, **args):
+        """return a tuple (persons, total): a page of persons satisfying the arguments, and the total number of them"""
+        return self.db.get_persons_page(start=start, size=size, **args)
+
+    def get_persons_after(self, after=None, size=50, **args):
+        """return a tuple (persons, after): the persons following after, and the continuation to get the next ones"""
+        return self.db.get_persons_after(after=after, size=size, **args)
+
+    def iter_persons(self, batch_size=500, **args):
+        """iterate over all persons satisfying the arguments, in the order of sort_key"""
+        return self.db.iter_persons(batch_size=batch_size, **args)
+
+    def export_persons(self, out, format='json', **args):  # @ReservedAssignment
+        """write the persons satisfying args to the file-like object out
+
+        arguments:
+            format: 'json' (one JSON object per line) or 'xml' (BioDes documents)
+        returns:
+            the number of persons written
+        """
+        exporter = PersonExporter(self)
+        if format == 'json':
+            return exporter.export_json(out, **args)
+        elif format == 'xml':
+            return exporter.export_xml(out, **args)
+        else:
+            raise ValueError('format must be one of "json" or "xml", not %s' % format)
+
     def get_persons_sequence(self, *args, **kwargs):
         return self.db.get_persons_sequence(*args, **kwargs)
 
@@ -289,41 +321,53 @@ class Repository(object):
                 self.delete_person(p)
         return
 
-    def download_illustrations(self, source, overwrite=False, limit=None):
+    def download_illustrations(self, source, overwrite=False, limit=None, threads=DOWNLOAD_THREADS):
         """Download the illustrations associated with the biographies in the source.
 
         arguments:
             - source:  a Source instance
             - overwrite: Boolean. If overwrite is true, then we download also if we already have this image.
                 default is False.
+            - limit: the maximum number of biographies to download the illustrations of
+            - threads: the number of simultaneous downloads
         returns:
-            (total, skipped)
+            a DownloadReport (which can be unpacked as a tuple (total, skipped))
         """
         if not self.images_cache_local:
             raise Exception('Cannot download illustrations, self.images_cache_local has not been set')
         bios = self.get_biographies(source=source)
-        total = 0
-        skipped = 0
-        for i, bio in enumerate(bios):
-            logging.info('[%s/%s] downloading illustrations' % (i + 1, len(bios)))
-            total += 1
-            if limit and total > limit:
-                break
-            for ill in bio.get_illustrations():
-                try:
-                    ill.download(overwrite=overwrite)
-                except CantDownloadImage, err:
-                    skipped += 1
-                    logging.warning("Can't download image: %s" % str(err))
+        if limit:
+            bios = bios[:limit]
+        report = DownloadReport()
+        report.total = len(bios)
+
+        def illustrations():
+            for i, bio in enumerate(bios):
+                logging.info('[%s/%s] downloading illustrations' % (i + 1, len(bios)))
+                for ill in bio.get_illustrations():
+                    yield ill
+
+        IllustrationDownloader(threads=threads).download(illustrations(), overwrite=overwrite, report=report)
+        logging.info(repr(report))
         # remove the temp directory which has been used to extract
         # the xml files
-        if source.url and source.url.endswith("tar.gz"):
-            afile = bio.source_url.replace('file://', '')
+        if bios and source.url and source.url.endswith("tar.gz"):
+            afile = bios[-1].source_url.replace('file://', '')
             directory = os.path.dirname(afile)
             if os.path.isdir(directory):
                 shutil.rmtree(directory)
 
-        return total, skipped
+        return report
+
+    def rebuild_thumbnails(self, processes=None, force=False):
+        """regenerate the missing and stale thumbnails of the images in self.images_cache_local
+
+        returns:
+            a ThumbnailReport
+        """
+        if not self.images_cache_local:
+            raise Exception('Cannot rebuild thumbnails, self.images_cache_local has not been set')
+        return rebuild_thumbnails(self.images_cache_local, processes=processes, force=force)
 
     def get_most_similar_persons(self, **args):
         """get the most similar pairs of person, name we can find
@@ -345,10 +389,20 @@ class Repository(object):
         # the oldest identifier will be the canonical one
         return self.db.identify(person1, person2)
 
+    def identify_batch(self, pairs):
+        """Identify the persons in each of the pairs
+
+        arguments:
+            pairs - a list of (person1, person2) tuples of Person instances
+        returns:
+            a list of Person instances - one for each group of identified persons
+        """
+        return self.db.identify_batch(pairs)
+
     def identify_persons(self, source_id, min_score):
         logging.info('Identifying all persons from {source_id} that are similar with a score of at least {min_score}'.format(source_id=source_id, min_score=min_score))
-        for _score, person1, person2 in self.get_most_similar_persons(source_id=source_id, min_score=min_score, size=None):
-            self.identify(person1, person2)
+        pairs = [(person1, person2) for _score, person1, person2 in self.get_most_similar_persons(source_id=source_id, min_score=min_score, size=None)]
+        return self.identify_batch(pairs)
 
     def antiidentify(self, person1, person2):
         self.db.antiidentify(person1, person2)
@@ -372,8 +426,13 @@ class Repository(object):
         return self.db.get_deferred()
 
     def get_identified(self, **args):
+        """return the persons that have been identified with others (cf. DBRepository.get_identified)"""
         return self.db.get_identified(**args)
 
+    def get_cluster(self, bioport_id):
+        """return the bioport ids of which the person with this bioport_id is made up"""
+        return self.db.get_cluster(bioport_id)
+
     def redirect_identifier(self, bioport_id, redirect_to):
         """make sure that:
         1. all biographies associated with bioport_id will be associated with redirect_to
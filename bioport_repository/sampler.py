@@ -0,0 +1,76 @@
+##########################################################################
+# Copyright (C) 2009 - 2014 Huygens ING & Gerbrandy S.R.L.
+#
+# This file is part of bioport.
+#
+# bioport is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public
+# License along with this program.  If not, see
+# <http://www.gnu.org/licenses/gpl-3.0.html>.
+##########################################################################
+
+"""Uniform random sampling of bioport ids
+
+The IdSampler keeps the ids in a dense array, so that a random id can be
+picked in constant time by choosing a random position. To remove an id, the
+last id of the array is moved to its position.
+"""
+
+import random
+import threading
+import time
+from array import array
+
+
+class IdSampler(object):
+    """A set of (integer) ids from which we can draw uniform random samples"""
+
+    def __init__(self, ids=()):
+        self._lock = threading.RLock()
+        self._ids = array('l')
+        self._positions = {}  # id -> position in self._ids
+        for i in ids:
+            self.add(i)
+        self.timestamp = time.time()  # the time of the last complete build
+        self.refreshed = self.timestamp  # the time of the last (incremental) refresh
+        self.watermark = None  # can be used to remember up to where the ids were refreshed
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, i):
+        return i in self._positions
+
+    def add(self, i):
+        with self._lock:
+            if i not in self._positions:
+                self._positions[i] = len(self._ids)
+                self._ids.append(i)
+
+    def remove(self, i):
+        with self._lock:
+            position = self._positions.pop(i, None)
+            if position is None:
+                return
+            last = self._ids.pop()
+            if last != i:
+                self._ids[position] = last
+                self._positions[last] = position
+
+    def sample(self, n=1):
+        """return a list of n different ids, chosen uniformly at random
+
+        if there are less than n ids, all ids are returned (in random order)
+        """
+        with self._lock:
+            n = min(n, len(self._ids))
+            return [self._ids[position] for position in random.sample(xrange(len(self._ids)), n)]
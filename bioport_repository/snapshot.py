@@ -0,0 +1,166 @@
+##########################################################################
+# Copyright (C) 2009 - 2014 Huygens ING & Gerbrandy S.R.L.
+#
+# This file is part of bioport.
+#
+# bioport is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public
+# License along with this program.  If not, see
+# <http://www.gnu.org/licenses/gpl-3.0.html>.
+##########################################################################
+
+"""Save and load snapshots of the tables that are computed from the biographies
+
+Computing the person tables (with Person.save, update_soundexes, the similarity cache, etc.)
+takes a long time. A snapshot contains the rows of these tables in a compact binary file,
+so that a test or staging database can be filled without computing anything.
+
+A snapshot is a gzipped stream of pickles:
+    a header (a dictionary with the format version and the names of the tables)
+    for each table: its name and columns, followed by lists of rows, followed by None
+
+NB: snapshots are pickles - only load snapshots that you made yourself.
+
+Usage:
+    python snapshot.py save DSN FILENAME
+    python snapshot.py load DSN FILENAME
+"""
+
+import sys
+import gzip
+import logging
+import cPickle as pickle
+
+from bioport_repository.db_definitions import Base
+
+SNAPSHOT_FORMAT = 1
+
+# the tables that are computed from the biographies (by Person.save and friends)
+DERIVED_TABLES = [
+    'person',
+    'person_name',
+    'person_soundex',
+    'person_source',
+    'person_browse',
+    'person_decade',
+    'person_cluster',
+    'relpersoncategory',
+    'relpersonreligion',
+    'cache_similarity_persons',
+    ]
+
+
+def _get_tables(tables):
+    """return the Table objects with these names, in the order in which they can be filled"""
+    return [table for table in Base.metadata.sorted_tables if table.name in tables]
+
+
+def save_snapshot(db, filename, tables=DERIVED_TABLES, chunk_size=10000):
+    """write the contents of the tables to a snapshot file
+
+    arguments:
+        db: a DBRepository instance
+        filename: the name of the file to write to
+        tables: the names of the tables to include
+        chunk_size: the number of rows that are read and written at once
+    returns:
+        a dictionary with the number of rows of each table
+    """
+    counts = {}
+    tables = _get_tables(tables)
+    f = gzip.open(filename, 'wb')
+    try:
+        pickle.dump({'format': SNAPSHOT_FORMAT, 'tables': [table.name for table in tables]}, f, pickle.HIGHEST_PROTOCOL)
+        connection = db.engine.connect()
+        try:
+            for table in tables:
+                columns = [column.name for column in table.columns]
+                pickle.dump((table.name, columns), f, pickle.HIGHEST_PROTOCOL)
+                result = connection.execute(table.select())
+                n = 0
+                while True:
+                    rows = result.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    pickle.dump([tuple(row) for row in rows], f, pickle.HIGHEST_PROTOCOL)
+                    n += len(rows)
+                pickle.dump(None, f, pickle.HIGHEST_PROTOCOL)
+                counts[table.name] = n
+                logging.info('saved %s rows of %s' % (n, table.name))
+        finally:
+            connection.close()
+    finally:
+        f.close()
+    return counts
+
+
+def load_snapshot(db, filename):
+    """replace the contents of the tables in the snapshot file with the rows in the snapshot
+
+    arguments:
+        db: a DBRepository instance
+        filename: the name of a file written by save_snapshot
+    returns:
+        a dictionary with the number of rows of each table
+    """
+    counts = {}
+    f = gzip.open(filename, 'rb')
+    try:
+        header = pickle.load(f)
+        if header.get('format') != SNAPSHOT_FORMAT:
+            raise ValueError('%s is not a snapshot in format %s' % (filename, SNAPSHOT_FORMAT))
+        tables = dict([(table.name, table) for table in _get_tables(header['tables'])])
+        connection = db.engine.connect()
+        transaction = connection.begin()
+        try:
+            # delete the old rows (in reverse order, because of the foreign keys)
+            for table in reversed(_get_tables(header['tables'])):
+                connection.execute(table.delete())
+            for _i in range(len(header['tables'])):
+                table_name, columns = pickle.load(f)
+                table = tables[table_name]
+                n = 0
+                while True:
+                    rows = pickle.load(f)
+                    if rows is None:
+                        break
+                    connection.execute(table.insert(), [dict(zip(columns, row)) for row in rows])
+                    n += len(rows)
+                counts[table_name] = n
+                logging.info('loaded %s rows of %s' % (n, table_name))
+            transaction.commit()
+        except:
+            transaction.rollback()
+            raise
+        finally:
+            connection.close()
+    finally:
+        f.close()
+    # the in-memory indexes and caches are out of date now
+    db._name_index = None
+    db._random_sampler = None
+    db.invalidate_person_caches()
+    return counts
+
+
+if __name__ == '__main__':
+    from bioport_repository.repository import Repository
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) != 4 or sys.argv[1] not in ('save', 'load'):
+        print __doc__
+        sys.exit(1)
+    command, dsn, filename = sys.argv[1:]
+    db = Repository(dsn=dsn).db
+    if command == 'save':
+        print save_snapshot(db, filename)
+    else:
+        print load_snapshot(db, filename)
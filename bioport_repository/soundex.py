@@ -0,0 +1,75 @@
+##########################################################################
+# Copyright (C) 2009 - 2014 Huygens ING & Gerbrandy S.R.L.
+#
+# This file is part of bioport.
+#
+# bioport is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public
+# License along with this program.  If not, see
+# <http://www.gnu.org/licenses/gpl-3.0.html>.
+##########################################################################
+
+"""Memoized soundex generation
+
+Computing soundexes is relatively expensive, and we compute the soundexes of the
+same (common) tokens, like "Jan", "van" or "Pieter", over and over again when
+searching and when rebuilding the name tables.
+"""
+
+import simplejson
+from names import similarity
+
+from bioport_repository.common import LRUCache
+
+SOUNDEX_CACHE_SIZE = 100000
+
+
+def _freeze(value):
+    """return a hashable version of value (lists become tuples)"""
+    if isinstance(value, (list, tuple)):
+        return tuple([_freeze(x) for x in value])
+    return value
+
+
+class SoundexCache(LRUCache):
+    """A bounded cache of soundexes, keyed by the input string and the soundex parameters"""
+
+    def soundexes_nl(self, s, **args):
+        """return names.similarity.soundexes_nl(s, **args), remembering the result"""
+        key = (s, _freeze(sorted(args.items())))
+        result = self.get(key)
+        if result is None:
+            result = similarity.soundexes_nl(s, **args)
+            self.set(key, result)
+        # return a copy, so callers cannot change the cached value
+        return list(result)
+
+    def dump(self, filename):
+        """write the contents of the cache to a file"""
+        data = [[s, params, result] for (s, params), result in self.items()]
+        with open(filename, 'w') as f:
+            simplejson.dump(data, f)
+
+    def load(self, filename):
+        """read soundexes from a file written by dump, to warm the cache"""
+        with open(filename) as f:
+            data = simplejson.load(f)
+        for s, params, result in data:
+            self.set((s, _freeze(params)), result)
+
+
+SOUNDEX_CACHE = SoundexCache(maxsize=SOUNDEX_CACHE_SIZE)
+
+
+def soundexes_nl(s, **args):
+    """a memoized version of names.similarity.soundexes_nl"""
+    return SOUNDEX_CACHE.soundexes_nl(s, **args)
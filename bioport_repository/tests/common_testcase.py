@@ -26,6 +26,7 @@ import sqlalchemy
 from bioport_repository.repository import Repository
 from bioport_repository.tests.config import DSN, THIS_DIR, SVN_REPOSITORY, SVN_REPOSITORY_LOCAL_COPY, IMAGES_CACHE_LOCAL, SQLDUMP_FILENAME, CREATE_NEW_DUMPFILE
 from bioport_repository.biography import Biography
+from bioport_repository.illustration import clear_image_caches
 from bioport_repository.source import Source
 from gerbrandyutils import sh
 
@@ -64,6 +65,7 @@ class CommonTestCase(unittest.TestCase):
         self.repo.db.metadata.drop_all()
         if os.path.exists(IMAGES_CACHE_LOCAL):
             shutil.rmtree(IMAGES_CACHE_LOCAL)
+        clear_image_caches()
 
     def create_filled_repository(self, sources=None):
         """create  a repository filled with example data"""
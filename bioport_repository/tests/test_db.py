@@ -18,9 +18,11 @@
 # <http://www.gnu.org/licenses/gpl-3.0.html>.
 ##########################################################################
 
+import datetime
+
 from bioport_repository.tests.common_testcase import CommonTestCase
-from bioport_repository.db import Source, BiographyRecord, SourceRecord, Biography
-from bioport_repository.db_definitions import RelPersonCategory, PersonSoundex, RELIGION_VALUES, STATUS_NOBIOS
+from bioport_repository.db import Source, BiographyRecord, SourceRecord, Biography, _pack_ids, _unpack_ids
+from bioport_repository.db_definitions import RelPersonCategory, PersonSoundex, PersonName, PersonRecord, RELIGION_VALUES, STATUS_NOBIOS
 from bioport_repository.common import BioPortException
 
 
@@ -198,7 +200,15 @@ class DBRepositoryTestCase(CommonTestCase):
         self.repo.delete_person(person)
         
     def test_update_soundexes(self):
-        self.repo.db.update_soundexes()
+        session = self.db.get_session()
+        n_soundexes = session.query(PersonSoundex).count()
+        n_names = session.query(PersonName).count()
+        self.repo.db.update_soundexes(processes=2, chunk_size=3)
+        session = self.db.get_session()
+        self.assertEqual(session.query(PersonSoundex).count(), n_soundexes)
+        self.assertEqual(session.query(PersonName).count(), n_names)
+        self.assertEqual(len(self.repo.get_persons(search_name=u'bosma')), 9)
+        self.assertEqual(len(self.repo.get_persons(search_name=u'"molloyx"')), 1)
 
     def test_saving_of_categories(self):
         repo = self.repo
@@ -284,6 +294,130 @@ class DBRepositoryTestCase(CommonTestCase):
         self.assertEqual(len(repo.get_persons(geboorteplaats='Am*')), 3)
         self.assertEqual(len(repo.get_persons(sterfplaats='*en')), 3)
 
+    def test_count_persons(self):
+        repo = self.repo
+        self.assertEqual(repo.db.count_persons(), 10)
+        self.assertEqual(repo.db.count_persons(source_id=u'knaw2'), 5)
+        # the order of the results does not change the count
+        self.assertEqual(repo.db.count_persons(source_id=u'knaw2', order_by='naam'), 5)
+
+        persons, total = repo.get_persons_page(start=0, size=3)
+        self.assertEqual(len(persons), 3)
+        self.assertEqual(total, 10)
+        self.assertEqual(list(persons), list(repo.get_persons()[:3]))
+        persons, total = repo.get_persons_page(start=9, size=3)
+        self.assertEqual(len(persons), 1)
+        self.assertEqual(total, 10)
+
+        # saving persons invalidates the cached counts
+        repo.identify(repo.get_persons(source_id=u'knaw')[0], repo.get_persons(source_id=u'knaw2')[-1])
+        self.assertEqual(repo.db.count_persons(), 9)
+        persons, total = repo.get_persons_page(start=0, size=3)
+        self.assertEqual(total, 9)
+
+    def test_persons_result_cache(self):
+        repo = self.repo
+        self.db.invalidate_person_caches()
+        ls = list(repo.get_persons(source_id=u'knaw'))
+        self.assertEqual(len(self.db._result_cache), 1)
+        self.assertEqual(list(repo.get_persons(source_id=u'knaw')), ls)
+        self.assertEqual(self.db._result_cache.hits, 1)
+        # random results are not cached
+        repo.get_persons(order_by='random')
+        self.assertEqual(len(self.db._result_cache), 1)
+        # saving a person invalidates the cache
+        ls[0].save()
+        self.assertEqual(len(self.db._result_cache), 0)
+        self.assertEqual(list(repo.get_persons(source_id=u'knaw')), ls)
+
+    def test_random_persons(self):
+        repo = self.repo
+        all_ids = set([p.bioport_id for p in repo.get_persons()])
+        persons = repo.get_persons(order_by='random', size=3)
+        self.assertEqual(len(persons), 3)
+        self.assertEqual(len(set([p.bioport_id for p in persons])), 3)
+        self.assertTrue(set([p.bioport_id for p in persons]).issubset(all_ids))
+        # without a size, we get all persons in random order
+        self.assertEqual(set([p.bioport_id for p in repo.get_persons(order_by='random')]), all_ids)
+        # we cannot page through random results
+        self.assertRaises(AssertionError, repo.get_persons, order_by='random', start=2, size=3)
+        # with a filter
+        knaw_ids = set([p.bioport_id for p in repo.get_persons(source_id=u'knaw')])
+        persons = repo.get_persons(order_by='random', source_id=u'knaw', size=2)
+        self.assertEqual(len(persons), 2)
+        self.assertTrue(set([p.bioport_id for p in persons]).issubset(knaw_ids))
+        # deleted persons are not chosen anymore
+        person = repo.get_persons()[0]
+        repo.delete_person(person)
+        self.assertFalse(person.bioport_id in [p.bioport_id for p in repo.get_persons(order_by='random')])
+        # persons deleted by another process (i.e. that our sampler did not hear of) are not chosen either
+        person = repo.get_persons()[0]
+        repo.delete_person(person)
+        sampler = self.db.get_random_sampler()
+        sampler.add(person.bioport_id)
+        ids = [p.bioport_id for p in repo.get_persons(order_by='random', size=len(sampler))]
+        self.assertFalse(person.bioport_id in ids)
+        self.assertEqual(len(ids), len(all_ids) - 2)
+        self.assertFalse(person.bioport_id in sampler)
+
+    def test_browse_index(self):
+        repo = self.repo
+        self.db.rebuild_browse_index()
+        queries = [
+            dict(),
+            dict(beginletter='j'),
+            dict(category=1),
+            dict(beginletter='j', category=1),
+            dict(start=2, size=3),
+            ]
+        expected = [[p.bioport_id for p in repo.get_persons(**qry)] for qry in queries]
+        self.db.USE_BROWSE_INDEX = True
+        try:
+            self.db.invalidate_person_caches()
+            for qry, ls in zip(queries, expected):
+                self.assertEqual(self.db._get_browse_ids(**qry), ls)
+                self.assertEqual([p.bioport_id for p in repo.get_persons(**qry)], ls)
+            # other filters are not answered from the index
+            self.assertEqual(self.db._get_browse_ids(source_id=u'knaw'), None)
+            self.assertEqual(self.db._get_browse_ids(hide_no_external_biographies=False), None)
+            # the index is updated when a person is saved
+            person = repo.get_persons()[0]
+            person.record.status = STATUS_NOBIOS
+            repo.save_person(person)
+            self.assertFalse(person.bioport_id in self.db._get_browse_ids())
+            self.assertEqual(len(repo.get_persons()), len(expected[0]) - 1)
+        finally:
+            del self.db.USE_BROWSE_INDEX
+
+    def test_get_persons_after(self):
+        repo = self.repo
+        all_ids = [p.bioport_id for p in repo.get_persons()]
+        ids = []
+        after = None
+        while True:
+            persons, after = repo.get_persons_after(after=after, size=3)
+            ids += [p.bioport_id for p in persons]
+            if after is None:
+                break
+            self.assertEqual(after[1], persons[-1].bioport_id)
+        self.assertEqual(ids, all_ids)
+        self.assertEqual([p.bioport_id for p in repo.iter_persons(batch_size=4)], all_ids)
+        knaw_ids = [p.bioport_id for p in repo.get_persons(source_id=u'knaw')]
+        self.assertEqual([p.bioport_id for p in repo.iter_persons(batch_size=2, source_id=u'knaw')], knaw_ids)
+
+    def test_iterate_personlist(self):
+        repo = self.repo
+        persons = repo.get_persons()
+        self.assertEqual(list(persons), [persons[i] for i in range(len(persons))])
+        self.assertEqual([p.name() for p in persons], [persons[i].name() for i in range(len(persons))])
+        self.assertEqual(persons.get_bioport_ids(), [p.bioport_id for p in persons])
+        self.assertEqual(persons[2:4].get_bioport_ids(), [p.bioport_id for p in persons][2:4])
+
+    def test_pack_ids(self):
+        ls = [123456, 12345678L]
+        self.assertEqual(_unpack_ids(_pack_ids(ls)), ls)
+        self.assertEqual(_unpack_ids(_pack_ids([])), [])
+
     def test_get_bioport_id(self):
         repo = self.repo
         some_person = repo.get_persons()[1]
@@ -320,6 +454,32 @@ class DBRepositoryTestCase(CommonTestCase):
         self.assertEqual(len(repo.get_persons(search_family_name_only=True, search_name=u'"hilbrand"')), 0)
         self.assertEqual(len(repo.get_persons(search_family_name_only=True, search_name=u'"boschma"')), 9)
 
+    def test_search_exact_name_with_name_index(self):
+        repo = self.repo
+        self.db.USE_NAME_INDEX = True
+        try:
+            self.assertEqual(len(repo.get_persons(search_name=u'"hilbrand boschma"')), 9)
+            self.assertEqual(len(repo.get_persons(search_name=u'"molloyx"')), 1)
+            self.assertEqual(len(repo.get_persons(search_name=u'"mollo*"')), 1)
+            self.assertEqual(len(repo.get_persons(search_family_name_only=True, search_name=u'"hilbrand"')), 0)
+            # the index is updated when we add a person
+            self._add_person('Pius IX')
+            self.assertEqual(len(repo.get_persons(search_name=u'"pius"')), 1)
+            # changes made by another process are seen when the index is refreshed
+            bioport_id = repo.get_persons(search_name=u'"molloyx"')[0].bioport_id
+            with self.db.get_session_context() as session:
+                session.add(PersonName(bioport_id=bioport_id, name=u'godot', is_from_family_name=False))
+                qry = session.query(PersonRecord).filter(PersonRecord.bioport_id == bioport_id)
+                qry.update({'timestamp': datetime.datetime.now() + datetime.timedelta(1)}, synchronize_session=False)
+            self.db.invalidate_person_caches()
+            self.assertEqual(len(repo.get_persons(search_name=u'"godot"')), 0)
+            self.db.get_name_index().refreshed -= self.db.NAME_INDEX_REFRESH + 1
+            self.db.invalidate_person_caches()
+            self.assertEqual(len(repo.get_persons(search_name=u'"godot"')), 1)
+        finally:
+            del self.db.USE_NAME_INDEX
+            self.db._name_index = None
+
     def test_complex_geboorte_date_get_persons_full(self):
         self.create_filled_repository()
         repo = self.repo
@@ -346,6 +506,24 @@ class DBRepositoryTestCase(CommonTestCase):
         qry = dict(levendjaar_max=1800, levendmaand_max=2)
         self.assertEqual(len(repo.get_persons(**qry)), 4)
 
+    def test_levend_with_decade_index(self):
+        repo = self.repo
+        queries = [
+            dict(levendjaar_min=1778, levendmaand_min=1, levenddag_min=12, levendjaar_max=1778, levendmaand_max=2, levenddag_max=21),
+            dict(levendjaar_min=1770, levendjaar_max=1770),
+            dict(levendjaar_min=1700, levendjaar_max=1800),
+            dict(levendjaar_min=1850),
+            dict(levendjaar_max=1800),
+            ]
+        expected = [set([p.bioport_id for p in repo.get_persons(**qry)]) for qry in queries]
+        self.db.rebuild_decade_index()
+        self.db.USE_DECADE_INDEX = True
+        try:
+            for qry, ids in zip(queries, expected):
+                self.assertEqual(set([p.bioport_id for p in repo.get_persons(**qry)]), ids)
+        finally:
+            del self.db.USE_DECADE_INDEX
+
     def test_complex_geboorte_date_get_persons_partial(self):
         self.create_filled_repository()
         repo = self.repo
@@ -354,6 +532,12 @@ class DBRepositoryTestCase(CommonTestCase):
         self.assertEqual(len(repo.get_persons(**qry)), 3)
         qry.update(dict(geboortemaand_max="1", geboortedag_max="10"))
         self.assertEqual(len(repo.get_persons(**qry)), 2)
+        # without a day, we search until the end of the month
+        qry = dict(geboortemaand_min="1", geboortemaand_max="1")
+        self.assertEqual(
+            len(repo.get_persons(**qry)),
+            len(repo.get_persons(geboortemaand_min="1", geboortedag_min="1", geboortemaand_max="1", geboortedag_max="31")),
+            )
 
     def test_complex_sterf_date_get_persons_full(self):
         self.create_filled_repository()
@@ -387,7 +571,7 @@ class DBRepositoryTestCase(CommonTestCase):
         self.assertEqual(len(repo.get_persons(**qry)), 3)
         # Let's check that a date with the year only is not returned
         self.db.get_session().execute(
-            "UPDATE person set sterfdatum_min ='1882-01-01', sterfdatum_max='1882-12-31'"
+            "UPDATE person set sterfdatum_min ='1882-01-01', sterfdatum_max='1882-12-31', deathday=NULL"
             " WHERE sterfdatum_min ='1882-01-15'")
         self.assertEqual(len(repo.get_persons(**qry)), 2)
 
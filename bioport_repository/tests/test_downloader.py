@@ -0,0 +1,135 @@
+##########################################################################
+# Copyright (C) 2009 - 2014 Huygens ING & Gerbrandy S.R.L.
+#
+# This file is part of bioport.
+#
+# bioport is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public
+# License along with this program.  If not, see
+# <http://www.gnu.org/licenses/gpl-3.0.html>.
+##########################################################################
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from bioport_repository.illustration import Illustration, CantDownloadImage
+from bioport_repository.downloader import IllustrationDownloader, DownloadReport
+
+THIS_DIR = os.path.abspath(os.path.dirname(__file__))
+url_root = 'file://%s/data/images/' % THIS_DIR
+
+
+class FlakyIllustration(object):
+    """an illustration that fails to download a number of times"""
+
+    def __init__(self, url, failures=0, status=503):
+        self.source_url = self.id = url
+        self.failures = failures
+        self.status = status
+        self.attempts = 0
+
+    def download(self, overwrite=False):
+        self.attempts += 1
+        if self.attempts <= self.failures:
+            raise CantDownloadImage('failure %s' % self.attempts, status=self.status, transient=self.status >= 500)
+
+
+class DownloaderTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.images_cache_local = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.images_cache_local)
+
+    def _illustration(self, url):
+        return Illustration(url=url, images_cache_local=self.images_cache_local, images_cache_url='', prefix='test')
+
+    def test_download(self):
+        illustrations = [
+            self._illustration(url_root + 'image1.jpg'),
+            self._illustration(url_root + 'image2.jpg'),
+            self._illustration(url_root + 'image1.jpg'),
+            self._illustration(url_root + 'does_not_exist.jpg'),
+            ]
+        report = IllustrationDownloader(threads=3).download(illustrations)
+        self.assertEqual(report.illustrations, 3)
+        self.assertEqual(report.downloaded, 2)
+        self.assertEqual(report.failed, 1)
+        # we do not retry files
+        self.assertEqual(report.retries, 0)
+        self.assertEqual(report.errors[0][0], url_root + 'does_not_exist.jpg')
+        self.assertTrue(illustrations[0].has_image())
+        self.assertTrue(illustrations[1].has_image())
+
+    def test_retries(self):
+        illustrations = [
+            FlakyIllustration('http://example.org/1.jpg', failures=2),
+            FlakyIllustration('http://example.org/2.jpg', failures=5),
+            FlakyIllustration('http://example.com/3.jpg'),
+            ]
+        report = IllustrationDownloader(threads=2, retries=3, backoff=0.01).download(illustrations)
+        self.assertEqual(report.downloaded, 2)
+        self.assertEqual(report.failed, 1)
+        self.assertEqual(report.retries, 5)
+        self.assertEqual([ill.attempts for ill in illustrations], [3, 4, 1])
+
+    def test_no_retries_of_permanent_errors(self):
+        illustrations = [
+            FlakyIllustration('http://example.org/1.jpg', failures=1, status=404),
+            FlakyIllustration('http://example.org/2.jpg', failures=1, status=410),
+            ]
+        report = IllustrationDownloader(threads=2, retries=3, backoff=0.01).download(illustrations)
+        self.assertEqual(report.failed, 2)
+        self.assertEqual(report.retries, 0)
+        self.assertEqual([ill.attempts for ill in illustrations], [1, 1])
+
+    def test_per_host(self):
+        lock = threading.Lock()
+        running = {}
+        maximum = {}
+
+        class SlowIllustration(FlakyIllustration):
+            def download(self, overwrite=False):
+                host = self.source_url.split('/')[2]
+                with lock:
+                    running[host] = running.get(host, 0) + 1
+                    maximum[host] = max(maximum.get(host, 0), running[host])
+                threading.Event().wait(0.01)
+                with lock:
+                    running[host] -= 1
+
+        illustrations = [SlowIllustration('http://example.org/%s.jpg' % i) for i in range(10)]
+        illustrations += [SlowIllustration('http://example.com/%s.jpg' % i) for i in range(10)]
+        report = IllustrationDownloader(threads=6, per_host=2).download(illustrations)
+        self.assertEqual(report.downloaded, 20)
+        self.assertTrue(max(maximum.values()) <= 2)
+
+    def test_report(self):
+        report = DownloadReport()
+        report.total = 3
+        report.add_failure(FlakyIllustration('x'), 'error')
+        total, skipped = report
+        self.assertEqual((total, skipped), (3, 1))
+
+
+def test_suite():
+    return unittest.TestSuite((
+        unittest.makeSuite(DownloaderTestCase, 'test'),
+        ))
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
@@ -0,0 +1,65 @@
+##########################################################################
+# Copyright (C) 2009 - 2014 Huygens ING & Gerbrandy S.R.L.
+#
+# This file is part of bioport.
+#
+# bioport is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public
+# License along with this program.  If not, see
+# <http://www.gnu.org/licenses/gpl-3.0.html>.
+##########################################################################
+
+import unittest
+from StringIO import StringIO
+
+import simplejson
+
+from bioport_repository.tests.common_testcase import CommonTestCase
+from bioport_repository.export import PersonExporter
+
+
+class ExportTestCase(CommonTestCase):
+
+    def test_get_biographies_of_persons(self):
+        repo = self.repo
+        persons = repo.get_persons()
+        biographies = repo.db.get_biographies_of_persons([p.bioport_id for p in persons])
+        for person in persons:
+            self.assertEqual([bio.id for bio in biographies[person.bioport_id]], [bio.id for bio in person.get_biographies()])
+
+    def test_export_json(self):
+        repo = self.repo
+        out = StringIO()
+        exporter = PersonExporter(repo, batch_size=3)
+        self.assertEqual(exporter.export_json(out), 10)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 10)
+        persons = repo.get_persons()
+        self.assertEqual([simplejson.loads(line)['bioport_id'] for line in lines], [p.bioport_id for p in persons])
+        self.assertEqual(simplejson.loads(lines[0]), persons[0].get_merged_biography().to_dict())
+
+    def test_export_xml(self):
+        repo = self.repo
+        out = StringIO()
+        self.assertEqual(repo.export_persons(out, format='xml', source_id=u'knaw'), 5)
+        self.assertEqual(out.getvalue().count('<biodes'), 5)
+        self.assertRaises(ValueError, repo.export_persons, out, format='csv')
+
+
+def test_suite():
+    return unittest.TestSuite((
+        unittest.makeSuite(ExportTestCase, 'test'),
+        ))
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
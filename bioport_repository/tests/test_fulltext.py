@@ -0,0 +1,105 @@
+##########################################################################
+# Copyright (C) 2009 - 2014 Huygens ING & Gerbrandy S.R.L.
+#
+# This file is part of bioport.
+#
+# bioport is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public
+# License along with this program.  If not, see
+# <http://www.gnu.org/licenses/gpl-3.0.html>.
+##########################################################################
+
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from bioport_repository.tests.common_testcase import CommonTestCase
+from bioport_repository.db_definitions import PersonRecord
+from bioport_repository.fulltext import LikeFullTextIndex, SQLiteFullTextIndex, search_words
+
+
+class FullTextTestCase(unittest.TestCase):
+
+    def test_search_words(self):
+        self.assertEqual(search_words(u'jan  de-vries!'), [u'jan', u'de', u'vries'])
+        self.assertEqual(search_words(u'"'), [])
+
+    def test_highlight(self):
+        index = LikeFullTextIndex(db=None)
+        text = u'Jan de Vries was de zoon van Jan.'
+        self.assertEqual(index.highlight(text, u'jan'), [(0, 3), (29, 32)])
+        self.assertEqual(index.highlight(text, u'vries zoon'), [(7, 12), (20, 24)])
+        # we only highlight whole words
+        self.assertEqual(index.highlight(text, u'ja'), [])
+
+
+class SQLiteFullTextTestCase(unittest.TestCase):
+    """test the SQLiteFullTextIndex on an in-memory sqlite database"""
+
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        # this creates the fts table as well
+        PersonRecord.__table__.create(bind=engine)
+        self.session = sessionmaker(bind=engine)()
+        self.index = SQLiteFullTextIndex(db=None)
+        for bioport_id, search_source in [(1, u'Jan de Vries, schilder'), (2, u'Piet de Vries'), (3, u'Jan Molloy')]:
+            self.session.execute(PersonRecord.__table__.insert(), dict(bioport_id=bioport_id, search_source=search_source))
+            self.index.update(self.session, bioport_id, search_source)
+
+    def tearDown(self):
+        self.session.close()
+
+    def search(self, search_term, rank=False):
+        qry = self.session.query(PersonRecord.bioport_id)
+        qry = self.index.filter(qry, search_term, rank=rank)
+        return [r[0] for r in qry]
+
+    def test_filter(self):
+        self.assertEqual(sorted(self.search(u'vries')), [1, 2])
+        self.assertEqual(self.search(u'jan vries'), [1])
+        self.assertEqual(sorted(self.search(u'jan', rank=True)), [1, 3])
+        # words are not interpreted as FTS5 operators
+        self.assertEqual(self.search(u'jan OR piet'), [])
+        # a search term without words finds nothing
+        self.assertEqual(self.search(u'"'), [])
+        self.assertEqual(self.search(u'!?'), [])
+
+    def test_update(self):
+        self.index.update(self.session, 3, u'Jan Molloy, schilder')
+        self.assertEqual(sorted(self.search(u'schilder')), [1, 3])
+        self.index.remove(self.session, 1)
+        self.assertEqual(self.search(u'schilder'), [3])
+
+
+class FullTextSearchTestCase(CommonTestCase):
+
+    def test_search_term(self):
+        repo = self.repo
+        self.assertEqual(len(repo.get_persons(search_term=u'molloy')), 1)
+        self.assertEqual(len(repo.get_persons(search_term=u'molloy', order_by='relevance')), 1)
+        self.assertEqual(len(repo.get_persons(order_by='relevance')), 10)
+        # the index is updated when a person is saved
+        self._add_person('Pius IX')
+        self.assertEqual(len(repo.get_persons(search_term=u'pius')), 1)
+
+
+def test_suite():
+    return unittest.TestSuite((
+        unittest.makeSuite(FullTextTestCase, 'test'),
+        unittest.makeSuite(SQLiteFullTextTestCase, 'test'),
+        unittest.makeSuite(FullTextSearchTestCase, 'test'),
+        ))
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
@@ -27,6 +27,10 @@ import urllib2
 import unittest
 from cStringIO import StringIO
 import shutil
+import tempfile
+import threading
+import BaseHTTPServer
+from hashlib import sha1
 
 try:
     from PIL import Image
@@ -34,7 +38,8 @@ except ImportError:
     import Image
 
 from bioport_repository.tests.common_testcase import CommonTestCase, IMAGES_CACHE_LOCAL
-#from bioport_repository.illustration import MEDIUM_THUMB_SIZE
+from bioport_repository.illustration import MEDIUM_THUMB_SIZE, THUMB_SIZES
+from bioport_repository import illustration
 from bioport_repository.illustration import Illustration, CantDownloadImage
 
 #(all the encode(ENC) loops are for getting text
@@ -139,10 +144,233 @@ class ThumbnailTestCase(unittest.TestCase):
         data = urllib2.urlopen(ill.image_small_url).read()
         _img = Image.open(StringIO(data))
 
+    def test_create_thumbnails(self):
+        ill = self.ill
+        ill.download()
+        original = Image.open(ill.cached_local)
+        for width, height in THUMB_SIZES:
+            img = Image.open(ill._thumbnail_filename(width, height))
+            self.assertTrue(img.size[0] <= width and img.size[1] <= height)
+            # the thumbnail is as large as it can be
+            self.assertTrue(img.size[0] >= min(width, original.size[0]) - 1 or img.size[1] >= min(height, original.size[1]) - 1)
+        # existing thumbnails are not created again
+        self.assertEqual(ill.create_thumbnails(), [])
+        ill._remove_thumbnails()
+        self.assertEqual(len(ill.create_thumbnails()), len(THUMB_SIZES))
+
+
+class DownloadTestCase(unittest.TestCase):
+
+    def setUp(self):
+        if not os.path.exists(images_cache_local):
+            os.mkdir(images_cache_local)
+
+    def tearDown(self):
+        shutil.rmtree(images_cache_local)
+        illustration.clear_image_caches()
+
+    def test_download_checksum(self):
+        ill = Illustration(url=os.path.join(url_root, fn), images_cache_local=images_cache_local, images_cache_url=images_cache_url, prefix='test')
+        ill.download()
+        data = open(os.path.join(images, fn), 'rb').read()
+        self.assertEqual(open(ill.cached_local, 'rb').read(), data)
+        self.assertEqual(ill.checksum, sha1(data).hexdigest())
+        self.assertEqual(ill.size, len(data))
+        # no temporary files are left behind
+        self.assertEqual([f for f in os.listdir(images_cache_local) if f.startswith('.download_')], [])
+
+    def test_download_too_large(self):
+        ill = Illustration(url=os.path.join(url_root, fn), images_cache_local=images_cache_local, images_cache_url=images_cache_url, prefix='test')
+        old_max = illustration.MAX_IMAGE_SIZE
+        illustration.MAX_IMAGE_SIZE = 10
+        try:
+            self.assertRaises(CantDownloadImage, ill.download)
+        finally:
+            illustration.MAX_IMAGE_SIZE = old_max
+        self.assertFalse(ill.has_image())
+
+    def test_download_metadata(self):
+        ill = Illustration(url=os.path.join(url_root, fn), images_cache_local=images_cache_local, images_cache_url=images_cache_url, prefix='test')
+        self.assertEqual(ill.get_metadata(), None)
+        ill.download()
+        metadata = ill.get_metadata()
+        self.assertEqual(metadata['url'], ill.source_url)
+        self.assertEqual(metadata['checksum'], ill.checksum)
+        thumbnail = ill._thumbnail_filename(*MEDIUM_THUMB_SIZE)
+        os.utime(thumbnail, (0, 0))
+        # the image has not changed, so the thumbnails are not created again
+        ill.download(overwrite=True)
+        self.assertEqual(os.stat(thumbnail).st_mtime, 0)
+
+    def test_content_addressed(self):
+        # the same image, at another url
+        copy_directory = tempfile.mkdtemp()
+        shutil.copy(os.path.join(images, fn), copy_directory)
+        old_value = Illustration.CONTENT_ADDRESSED
+        Illustration.CONTENT_ADDRESSED = True
+        try:
+            ill1 = Illustration(url=os.path.join(url_root, fn), images_cache_local=images_cache_local, images_cache_url=images_cache_url, prefix='test')
+            ill2 = Illustration(url='file://%s/%s' % (copy_directory, fn), images_cache_local=images_cache_local, images_cache_url=images_cache_url, prefix='test')
+            self.assertNotEqual(ill1.id, ill2.id)
+            ill1.download()
+            ill2.download()
+        finally:
+            Illustration.CONTENT_ADDRESSED = old_value
+            shutil.rmtree(copy_directory)
+        # both images are the same file
+        content_filename = os.path.join(images_cache_local, 'content', ill1.checksum)
+        self.assertEqual(os.stat(ill1.cached_local).st_ino, os.stat(content_filename).st_ino)
+        self.assertEqual(os.stat(ill2.cached_local).st_ino, os.stat(content_filename).st_ino)
+        # and so are their thumbnails
+        self.assertEqual(os.stat(ill1._thumbnail_filename(*MEDIUM_THUMB_SIZE)).st_ino,
+                         os.stat(ill2._thumbnail_filename(*MEDIUM_THUMB_SIZE)).st_ino)
+
+    def test_content_addressed_threads(self):
+        # the same image at many urls, downloaded at the same time
+        copy_directories = [tempfile.mkdtemp() for _i in range(8)]
+        for copy_directory in copy_directories:
+            shutil.copy(os.path.join(images, fn), copy_directory)
+        illustrations = [Illustration(url='file://%s/%s' % (copy_directory, fn), images_cache_local=images_cache_local, images_cache_url=images_cache_url, prefix='test')
+                         for copy_directory in copy_directories]
+        errors = []
+
+        def download(ill):
+            try:
+                ill.download()
+            except Exception, error:
+                errors.append(error)
+        old_value = Illustration.CONTENT_ADDRESSED
+        Illustration.CONTENT_ADDRESSED = True
+        try:
+            threads = [threading.Thread(target=download, args=(ill,)) for ill in illustrations]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            Illustration.CONTENT_ADDRESSED = old_value
+            for copy_directory in copy_directories:
+                shutil.rmtree(copy_directory)
+        self.assertEqual(errors, [])
+        content_filename = os.path.join(images_cache_local, 'content', illustrations[0].checksum)
+        for ill in illustrations:
+            self.assertEqual(os.stat(ill.cached_local).st_ino, os.stat(content_filename).st_ino)
+        # no temporary files are left behind
+        self.assertEqual([f for f in os.listdir(images_cache_local) if f.startswith('.')], [])
+
+    def test_thumbnail_index(self):
+        ill = Illustration(url=os.path.join(url_root, fn), images_cache_local=images_cache_local, images_cache_url=images_cache_url, prefix='test')
+        index = illustration.get_thumbnail_index(images_cache_local)
+        basename = os.path.basename(ill._thumbnail_filename(*MEDIUM_THUMB_SIZE))
+        self.assertFalse(basename in index)
+        # downloading the image adds its thumbnails to the index
+        ill.download()
+        self.assertTrue(basename in index)
+        ill._remove_thumbnails()
+        self.assertFalse(basename in index)
+        # we remember that the thumbnail does not exist, so we do not look for it again
+        filename = os.path.join(index.directory, basename)
+        open(filename, 'w').close()
+        self.assertFalse(basename in index)
+        # until the index is read again
+        index.refresh()
+        self.assertTrue(basename in index)
+        # a thumbnail made by another process is found when we look for it the first time
+        os.remove(filename)
+        index.discard(basename)
+        open(filename, 'w').close()
+        self.assertTrue(basename in index)
+
+    def serve(self, respond):
+        """start an HTTP server that answers each GET request with respond(request_headers)
+
+        arguments:
+            respond: a function that returns a tuple (status, headers, data)
+        returns:
+            the url of the image on the server
+        """
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_GET(self):
+                status, headers, data = respond(self.headers)
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                if data is not None:
+                    self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                if data is not None:
+                    self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.shutdown)
+        return 'http://127.0.0.1:%s/image.jpg' % server.server_address[1]
+
+    def test_conditional_download(self):
+        data = open(os.path.join(images, fn), 'rb').read()
+        requests = []
+
+        def respond(headers):
+            requests.append(headers.get('If-None-Match'))
+            if headers.get('If-None-Match') == '"v1"':
+                return 304, {}, None
+            return 200, {'ETag': '"v1"'}, data
+
+        url = self.serve(respond)
+        ill = Illustration(url=url, images_cache_local=images_cache_local, images_cache_url=images_cache_url, prefix='test')
+        ill.download()
+        self.assertEqual(ill.get_metadata()['etag'], '"v1"')
+        ill.download(overwrite=True)
+        self.assertEqual(requests, [None, '"v1"'])
+        self.assertEqual(open(ill.cached_local, 'rb').read(), data)
+
+    def test_failed_refresh(self):
+        data = open(os.path.join(images, fn), 'rb').read()
+        requests = []
+
+        def respond(headers):
+            requests.append(headers)
+            if len(requests) > 1:
+                # the server has trouble
+                return 503, {}, None
+            return 200, {'ETag': '"v1"'}, data
+
+        url = self.serve(respond)
+        ill = Illustration(url=url, images_cache_local=images_cache_local, images_cache_url=images_cache_url, prefix='test')
+        ill.download()
+        try:
+            ill.download(overwrite=True)
+        except CantDownloadImage, error:
+            self.assertEqual(error.status, 503)
+            self.assertTrue(error.transient)
+        else:
+            self.fail('the download should have failed')
+        # we still have the image that we downloaded before
+        self.assertEqual(open(ill.cached_local, 'rb').read(), data)
+        self.assertEqual(ill.get_metadata()['etag'], '"v1"')
+
+    def test_unchanged_refresh(self):
+        data = open(os.path.join(images, fn), 'rb').read()
+        # a server that does not support conditional requests
+        url = self.serve(lambda headers: (200, {}, data))
+        ill = Illustration(url=url, images_cache_local=images_cache_local, images_cache_url=images_cache_url, prefix='test')
+        ill.download()
+        mtime = int(os.path.getmtime(ill.cached_local)) - 100
+        os.utime(ill.cached_local, (mtime, mtime))
+        ill.download(overwrite=True)
+        # the image has not changed, so we kept the file (and the thumbnails are not stale)
+        self.assertEqual(os.path.getmtime(ill.cached_local), mtime)
+        self.assertEqual(open(ill.cached_local, 'rb').read(), data)
+
 
 def test_suite():
     test_suite = unittest.TestSuite()
-    tests = [IllustrationTestCase, ThumbnailTestCase]
+    tests = [IllustrationTestCase, ThumbnailTestCase, DownloadTestCase]
     for test in tests:
         test_suite.addTest(unittest.makeSuite(test))
     return test_suite
@@ -0,0 +1,77 @@
+##########################################################################
+# Copyright (C) 2009 - 2014 Huygens ING & Gerbrandy S.R.L.
+#
+# This file is part of bioport.
+#
+# bioport is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public
+# License along with this program.  If not, see
+# <http://www.gnu.org/licenses/gpl-3.0.html>.
+##########################################################################
+
+import unittest
+
+from bioport_repository.name_index import NameIndex, intersect
+
+
+class NameIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.index = NameIndex()
+        self.index.build([
+            (1, u'Jan', False),
+            (1, u'Boschma', True),
+            (2, u'Jan', False),
+            (2, u'Bosma', True),
+            (3, u'Molloyx', True),
+            (3, u'Hilbrand', False),
+            ])
+
+    def test_intersect(self):
+        self.assertEqual(list(intersect([1, 3, 5, 7], [2, 3, 4, 7, 8])), [3, 7])
+        self.assertEqual(list(intersect([], [1])), [])
+
+    def test_search(self):
+        index = self.index
+        self.assertEqual(list(index.search([u'jan'])), [1, 2])
+        self.assertEqual(list(index.search([u'Jan', u'Boschma'])), [1])
+        self.assertEqual(list(index.search([u'Jan', u'Molloyx'])), [])
+        self.assertEqual(list(index.search([u'Hilbrand'], family_name_only=True)), [])
+        self.assertEqual(list(index.search([u'Bosma'], family_name_only=True)), [2])
+
+    def test_search_with_wildcards(self):
+        index = self.index
+        self.assertEqual(list(index.search([u'bos*'])), [1, 2])
+        self.assertEqual(list(index.search([u'mollo??'])), [3])
+        self.assertEqual(list(index.search([u'mollo?'])), [])
+        self.assertEqual(list(index.search([u'*ma', u'jan'])), [1, 2])
+
+    def test_update(self):
+        index = self.index
+        index.update(2, [(u'Piet', False), (u'Bosma', True)])
+        self.assertEqual(list(index.search([u'jan'])), [1])
+        self.assertEqual(list(index.search([u'piet', u'bosma'])), [2])
+        index.update(4, [(u'Jan', False)])
+        self.assertEqual(list(index.search([u'jan'])), [1, 4])
+        index.remove(3)
+        self.assertEqual(list(index.search([u'molloyx'])), [])
+        self.assertEqual(list(index.search([u'mol*'])), [])
+
+
+def test_suite():
+    return unittest.TestSuite((
+        unittest.makeSuite(NameIndexTestCase, 'test'),
+        ))
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
@@ -22,7 +22,7 @@ import os
 
 from bioport_repository.tests.common_testcase import CommonTestCase, unittest, THIS_DIR
 from bioport_repository.repository import Source, Biography
-from bioport_repository.db_definitions import AntiIdentifyRecord, STATUS_NEW, STATUS_ONLY_VISIBLE_IF_CONNECTED
+from bioport_repository.db_definitions import AntiIdentifyRecord, PersonCluster, STATUS_NEW, STATUS_ONLY_VISIBLE_IF_CONNECTED
 
 
 class RepositoryTestCase(CommonTestCase):
@@ -307,6 +307,79 @@ class RepositoryTestCase(CommonTestCase):
         self.assertEqual(p3.status, STATUS_NEW)
         self.assertEqual(p4.status, STATUS_NEW)
 
+    def test_identify_batch(self):
+        repo = self.repo
+        persons = repo.get_persons()
+        p1, p2, p3, p4, p5 = persons[1:6]
+        n_persons = len(persons)
+        n_bios = sum([len(p.get_biographies()) for p in [p1, p2, p3]])
+
+        # p1, p2 and p3 are the same person, and so are p4 and p5
+        ls = repo.identify_batch([(p1, p2), (p2, p3), (p4, p5)])
+        self.assertEqual([p.bioport_id for p in ls], [p1.bioport_id, p4.bioport_id])
+        self.assertEqual(len(repo.get_persons()), n_persons - 3)
+        self.assertEqual(len(ls[0].get_biographies()), n_bios)
+        self.assertEqual(repo.get_person(p3.bioport_id).bioport_id, p1.bioport_id)
+        self.assertEqual(repo.get_person(p5.bioport_id).bioport_id, p4.bioport_id)
+        self.assertEqual(len(repo.get_identified()), 2)
+
+        # identifying persons that are already identified does not change anything
+        ls = repo.identify_batch([(p2, p3)])
+        self.assertEqual([p.bioport_id for p in ls], [p1.bioport_id])
+        self.assertEqual(len(repo.get_persons()), n_persons - 3)
+
+    def test_identify_batch_pair_order(self):
+        repo = self.repo
+        persons = repo.get_persons()
+        p1, p2, p3 = persons[1:4]
+        n_persons = len(persons)
+        n_bios = sum([len(p.get_biographies()) for p in [p1, p2, p3]])
+        # p3 is identified with p2, which was identified with p1 before
+        ls = repo.identify_batch([(p1, p2), (p3, p2)])
+        self.assertEqual([p.bioport_id for p in ls], [p1.bioport_id])
+        self.assertEqual(len(repo.get_persons()), n_persons - 2)
+        self.assertEqual(len(ls[0].get_biographies()), n_bios)
+        self.assertEqual(repo.get_person(p2.bioport_id).bioport_id, p1.bioport_id)
+        self.assertEqual(repo.get_person(p3.bioport_id).bioport_id, p1.bioport_id)
+        # no bioport id redirects to itself
+        self.assertEqual(repo.db.get_cluster(p1.bioport_id), [p1.bioport_id] + sorted([p2.bioport_id, p3.bioport_id]))
+
+    def test_person_clusters(self):
+        repo = self.repo
+        db = repo.db
+        persons = repo.get_persons()
+        id1, id2, id3 = [p.bioport_id for p in persons[1:4]]
+        repo.identify_batch([(persons[1], persons[2]), (persons[2], persons[3])])
+        expected = [id1] + sorted([id2, id3])
+        self.assertEqual(db.get_cluster(id3), expected)
+        # the table is not maintained unless we use it
+        self.assertEqual(db.get_session().query(PersonCluster).count(), 0)
+
+        db.USE_PERSON_CLUSTERS = True
+        try:
+            db.rebuild_person_clusters()
+            rows = sorted(db.get_session().query(PersonCluster.bioport_id, PersonCluster.canonical_id).all())
+            self.assertEqual(rows, sorted([(bioport_id, id1) for bioport_id in expected]))
+            self.assertEqual(db.get_cluster(id3), expected)
+            self.assertEqual(db.redirects_to(id3), id1)
+            self.assertEqual([p.bioport_id for p in repo.get_identified()], [id1])
+            # identifying other persons adds their cluster to the table
+            person = repo.identify(persons[4], persons[5])
+            self.assertEqual(db.get_cluster(persons[5].bioport_id), db.get_cluster(persons[4].bioport_id))
+            rows = sorted(db.get_session().query(PersonCluster.bioport_id, PersonCluster.canonical_id).all())
+            self.assertEqual(len(rows), 5)
+            self.assertEqual(sorted([p.bioport_id for p in repo.get_identified()]), sorted([id1, person.bioport_id]))
+            # and rebuilding the table gives the same result
+            db.rebuild_person_clusters()
+            self.assertEqual(sorted(db.get_session().query(PersonCluster.bioport_id, PersonCluster.canonical_id).all()), rows)
+            # after unidentifying, the cluster is gone
+            repo.unidentify(repo.get_person(id1))
+            self.assertEqual(db.get_cluster(id3), [id3])
+            self.assertEqual(db.redirects_to(id3), id3)
+            self.assertEqual([p.bioport_id for p in repo.get_identified()], [person.bioport_id])
+        finally:
+            del db.USE_PERSON_CLUSTERS
+
     def test_detach_biography(self):
         repo = self.repo
         persons = repo.get_persons()
@@ -0,0 +1,63 @@
+##########################################################################
+# Copyright (C) 2009 - 2014 Huygens ING & Gerbrandy S.R.L.
+#
+# This file is part of bioport.
+#
+# bioport is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public
+# License along with this program.  If not, see
+# <http://www.gnu.org/licenses/gpl-3.0.html>.
+##########################################################################
+
+import os
+import tempfile
+import unittest
+
+from bioport_repository.tests.common_testcase import CommonTestCase
+from bioport_repository.snapshot import save_snapshot, load_snapshot
+from bioport_repository.db_definitions import PersonName
+
+
+class SnapshotTestCase(CommonTestCase):
+
+    def setUp(self):
+        CommonTestCase.setUp(self)
+        fd, self.filename = tempfile.mkstemp(suffix='.snapshot')
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.filename)
+        CommonTestCase.tearDown(self)
+
+    def test_save_and_load(self):
+        repo = self.repo
+        ids = [p.bioport_id for p in repo.get_persons()]
+        n_names = self.db.get_session().query(PersonName).count()
+        counts = save_snapshot(self.db, self.filename, chunk_size=7)
+        self.assertEqual(counts['person'], len(repo.get_persons(hide_invisible=False, no_empty_names=False)))
+
+        # remove a person, and load the snapshot to get it back
+        repo.delete_person(repo.get_persons()[0])
+        self.assertEqual(len(repo.get_persons()), len(ids) - 1)
+        self.assertEqual(load_snapshot(self.db, self.filename), counts)
+        self.assertEqual([p.bioport_id for p in repo.get_persons()], ids)
+        self.assertEqual(self.db.get_session().query(PersonName).count(), n_names)
+
+
+def test_suite():
+    return unittest.TestSuite((
+        unittest.makeSuite(SnapshotTestCase, 'test'),
+        ))
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
@@ -0,0 +1,84 @@
+##########################################################################
+# Copyright (C) 2009 - 2014 Huygens ING & Gerbrandy S.R.L.
+# 
+# This file is part of bioport.
+# 
+# bioport is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public
+# License along with this program.  If not, see
+# <http://www.gnu.org/licenses/gpl-3.0.html>.
+##########################################################################
+
+import os
+import tempfile
+import unittest
+
+from names.similarity import soundexes_nl
+from bioport_repository.common import LRUCache
+from bioport_repository.soundex import SoundexCache
+
+
+class LRUCacheTestCase(unittest.TestCase):
+
+    def test_lru_cache(self):
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        # 'b' is now the least recently used item, and is thrown away
+        cache.set('c', 3)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+
+
+class SoundexCacheTestCase(unittest.TestCase):
+
+    def test_soundexes_nl(self):
+        cache = SoundexCache(maxsize=10)
+        args = dict(group=2, length=20, filter_initials=True, filter_stop_words=False, wildcards=True)
+        expected = soundexes_nl(u'Pieter', **args)
+        self.assertEqual(cache.soundexes_nl(u'Pieter', **args), expected)
+        self.assertEqual(cache.soundexes_nl(u'Pieter', **args), expected)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        # other parameters give another entry in the cache
+        cache.soundexes_nl(u'Pieter', group=1)
+        self.assertEqual(cache.misses, 2)
+        # list arguments are accepted as well
+        cache.soundexes_nl(u'Jan van Pieter', filter_custom=['van'])
+        self.assertEqual(len(cache), 3)
+
+    def test_dump_and_load(self):
+        cache = SoundexCache()
+        cache.soundexes_nl(u'Jan', group=2, filter_custom=['van'])
+        fd, filename = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            cache.dump(filename)
+            cache2 = SoundexCache()
+            cache2.load(filename)
+        finally:
+            os.remove(filename)
+        cache2.soundexes_nl(u'Jan', group=2, filter_custom=['van'])
+        self.assertEqual((cache2.hits, cache2.misses), (1, 0))
+
+
+def test_suite():
+    return unittest.TestSuite((
+        unittest.makeSuite(LRUCacheTestCase, 'test'),
+        unittest.makeSuite(SoundexCacheTestCase, 'test'),
+        ))
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
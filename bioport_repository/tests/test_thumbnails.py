@@ -0,0 +1,91 @@
+##########################################################################
+# Copyright (C) 2009 - 2014 Huygens ING & Gerbrandy S.R.L.
+#
+# This file is part of bioport.
+#
+# bioport is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public
+# License along with this program.  If not, see
+# <http://www.gnu.org/licenses/gpl-3.0.html>.
+##########################################################################
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+from bioport_repository.illustration import THUMB_SIZES
+from bioport_repository.thumbnails import rebuild_thumbnails, find_stale_thumbnails, remove_orphaned_content
+
+THIS_DIR = os.path.abspath(os.path.dirname(__file__))
+images = os.path.join(THIS_DIR, 'data', 'images')
+
+
+class ThumbnailsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.images_cache_local = tempfile.mkdtemp()
+        for fn in ['image1.jpg', 'image2.jpg']:
+            shutil.copyfile(os.path.join(images, fn), os.path.join(self.images_cache_local, fn))
+        open(os.path.join(self.images_cache_local, 'not_an_image.jpg'), 'w').write('xxx')
+
+    def tearDown(self):
+        shutil.rmtree(self.images_cache_local)
+
+    def test_rebuild_thumbnails(self):
+        report = rebuild_thumbnails(self.images_cache_local, processes=2)
+        self.assertEqual(report.images, 3)
+        self.assertEqual(report.thumbnails, 2 * len(THUMB_SIZES))
+        self.assertEqual(report.failed, 1)
+        self.assertEqual(report.errors[0][0], os.path.join(self.images_cache_local, 'not_an_image.jpg'))
+        self.assertEqual(len(os.listdir(os.path.join(self.images_cache_local, 'thumbnails'))), 2 * len(THUMB_SIZES))
+
+        # now only the image that fails is left
+        self.assertEqual([source for source, _thumbnails in find_stale_thumbnails(self.images_cache_local)],
+            [os.path.join(self.images_cache_local, 'not_an_image.jpg')])
+
+        # thumbnails that are older than the image are stale
+        os.remove(os.path.join(self.images_cache_local, 'not_an_image.jpg'))
+        source = os.path.join(self.images_cache_local, 'image1.jpg')
+        later = time.time() + 10
+        os.utime(source, (later, later))
+        report = rebuild_thumbnails(self.images_cache_local, processes=2)
+        self.assertEqual((report.images, report.thumbnails, report.failed), (1, len(THUMB_SIZES), 0))
+
+        # unless we ask for all
+        report = rebuild_thumbnails(self.images_cache_local, processes=2, force=True)
+        self.assertEqual(report.images, 2)
+
+    def test_remove_orphaned_content(self):
+        content = os.path.join(self.images_cache_local, 'content')
+        os.mkdir(content)
+        os.link(os.path.join(self.images_cache_local, 'image1.jpg'), os.path.join(content, 'used'))
+        open(os.path.join(content, 'orphan'), 'w').write('xxx')
+        # recent orphans are kept
+        self.assertEqual(remove_orphaned_content(self.images_cache_local), 0)
+        self.assertEqual(remove_orphaned_content(self.images_cache_local, min_age=-1), 1)
+        self.assertEqual(os.listdir(content), ['used'])
+        # the file is not used anymore when the image is gone
+        os.remove(os.path.join(self.images_cache_local, 'image1.jpg'))
+        self.assertEqual(remove_orphaned_content(self.images_cache_local, min_age=-1), 1)
+        self.assertEqual(os.listdir(content), [])
+
+
+def test_suite():
+    return unittest.TestSuite((
+        unittest.makeSuite(ThumbnailsTestCase, 'test'),
+        ))
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
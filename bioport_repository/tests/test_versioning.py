@@ -93,6 +93,21 @@ class VersioningTestCase(CommonTestCase):
         self.assertEqual(person.get_value('birth_date'), date1)
         
     
+    def test_version_numbers(self):
+        repo = self.repo
+        bio = list(repo.get_biographies())[0]
+        dates = ['1111-01-01', '1222-01-01', '1333-01-01']
+        for date in dates:
+            bio.set_value(birth_date=date)
+            self._save_biography(bio, u'test_comment')
+        versions = repo.get_versions(document_id=bio.id)
+        #the most recent version is version 0, the original one has the highest number
+        self.assertEqual([version.version for version in versions], [0, 1, 2, 3])
+        self.assertEqual([version.biography.get_value('birth_date') for version in versions[:3]], list(reversed(dates)))
+        #there is only one current version
+        self.assertEqual(len(list(repo.get_biographies(local_id=bio.id))), 1)
+        self.assertEqual(repo.get_biography(local_id=bio.id).get_value('birth_date'), dates[-1])
+
     def test_undo_identification(self):
         repo = self.repo
         persons = repo.get_persons()
@@ -0,0 +1,227 @@
+##########################################################################
+# Copyright (C) 2009 - 2014 Huygens ING & Gerbrandy S.R.L.
+#
+# This file is part of bioport.
+#
+# bioport is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public
+# License along with this program.  If not, see
+# <http://www.gnu.org/licenses/gpl-3.0.html>.
+##########################################################################
+
+"""Regenerate the thumbnails of the images in the image cache
+
+This finds the images in images_cache_local of which thumbnails are missing or older
+than the image, and creates these thumbnails with a pool of processes.
+Use --all to regenerate all thumbnails (for example after changing THUMBNAIL_QUALITY)
+Afterwards, the files in the content directory that are not used anymore are removed
+(cf. Illustration.CONTENT_ADDRESSED).
+
+Usage:
+    python thumbnails.py IMAGES_CACHE_LOCAL [--all] [--processes N]
+"""
+
+import os
+import sys
+import time
+import tempfile
+import logging
+import optparse
+import multiprocessing
+
+from bioport_repository.illustration import (
+    THUMB_SIZES,
+    create_thumbnails,
+    ensure_directory,
+    get_thumbnail_index,
+    thumbnail_basename,
+    )
+
+# the subdirectories of images_cache_local that do not contain original images
+NO_IMAGE_DIRECTORIES = ['thumbnails', 'metadata', 'content']
+# files in the content directory that are not used anymore are kept for this many seconds
+# (so that images that are being downloaded right now can still link to them)
+ORPHANED_CONTENT_MIN_AGE = 3600
+
+
+class ThumbnailReport(object):
+    """Keeps count of the results of regenerating thumbnails"""
+
+    def __init__(self):
+        self.images = 0
+        self.thumbnails = 0
+        self.failed = 0
+        self.errors = []  # a list of (filename, error message) tuples
+        self.orphans = 0  # the number of unused files removed from the content directory
+        self.started = time.time()
+
+    def __repr__(self):
+        return '<ThumbnailReport: %s thumbnails of %s images, %s failed in %.1f seconds (%.1f images/second)>' % (
+            self.thumbnails, self.images, self.failed, self.elapsed, self.throughput)
+
+    @property
+    def elapsed(self):
+        return time.time() - self.started
+
+    @property
+    def throughput(self):
+        """the number of images processed per second"""
+        if not self.elapsed:
+            return 0.0
+        return self.images / self.elapsed
+
+
+def find_stale_thumbnails(images_cache_local, sizes=THUMB_SIZES, force=False):
+    """find the images whose thumbnails are missing or older than the image
+
+    arguments:
+        images_cache_local: the directory with the images
+        sizes: the sizes of the thumbnails
+        force: if True, return all thumbnails of all images
+    returns:
+        a generator of tuples (image filename, [((width, height), thumbnail filename), ...])
+    """
+    thumbnails_directory = os.path.join(images_cache_local, 'thumbnails')
+    for basename in os.listdir(images_cache_local):
+        if basename.startswith('.') or basename in NO_IMAGE_DIRECTORIES:
+            continue
+        source = os.path.join(images_cache_local, basename)
+        if not os.path.isfile(source):
+            continue
+        mtime = os.path.getmtime(source)
+        thumbnails = []
+        for width, height in sizes:
+            filename = os.path.join(thumbnails_directory, thumbnail_basename(basename, width, height))
+            if force or not os.path.exists(filename) or os.path.getmtime(filename) < mtime:
+                thumbnails.append(((width, height), filename))
+        if thumbnails:
+            yield source, thumbnails
+
+
+def _supports_hard_links(directory):
+    """return True if we can make hard links in directory"""
+    fd, filename = tempfile.mkstemp(dir=directory, prefix='.probe_')
+    os.close(fd)
+    try:
+        os.link(filename, filename + '_link')
+    except (OSError, AttributeError):
+        return False
+    else:
+        os.remove(filename + '_link')
+        return True
+    finally:
+        os.remove(filename)
+
+
+def remove_orphaned_content(images_cache_local, min_age=ORPHANED_CONTENT_MIN_AGE):
+    """remove the files in the content directory that no image or thumbnail uses anymore
+
+    The content directory has a hard link to each image and thumbnail (cf. Illustration.CONTENT_ADDRESSED),
+    so a file with only one link is not used anymore (for example, because the image was refreshed).
+
+    arguments:
+        images_cache_local: the directory with the images
+        min_age: only remove files that have not been used for this many seconds
+    returns:
+        the number of files that were removed
+    """
+    directory = os.path.join(images_cache_local, 'content')
+    if not os.path.isdir(directory) or not _supports_hard_links(directory):
+        # (without hard links, the files are copies, and we cannot tell if they are used)
+        return 0
+    now = time.time()
+    removed = 0
+    for basename in os.listdir(directory):
+        if basename.startswith('.'):
+            continue
+        filename = os.path.join(directory, basename)
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            # it was removed just now
+            continue
+        # (the ctime of a file changes when one of its links is removed)
+        if stat.st_nlink == 1 and now - stat.st_ctime > min_age:
+            os.remove(filename)
+            removed += 1
+    return removed
+
+
+def _rebuild(job):
+    """create the thumbnails of an image (this runs in the worker processes)
+
+    returns:
+        a tuple (source, number of thumbnails, error message or None)
+    """
+    source, thumbnails = job
+    try:
+        create_thumbnails(source, thumbnails)
+    except Exception, error:
+        return source, 0, '%s: %s' % (error.__class__.__name__, error)
+    return source, len(thumbnails), None
+
+
+def rebuild_thumbnails(images_cache_local, processes=None, force=False, sizes=THUMB_SIZES):
+    """regenerate the missing and stale thumbnails of the images in images_cache_local
+
+    arguments:
+        processes: the number of worker processes (default is the number of CPUs)
+        force: if True, regenerate all thumbnails
+    returns:
+        a ThumbnailReport
+    """
+    ensure_directory(os.path.join(images_cache_local, 'thumbnails'))
+    report = ThumbnailReport()
+    jobs = find_stale_thumbnails(images_cache_local, sizes=sizes, force=force)
+    pool = multiprocessing.Pool(processes)
+    try:
+        for source, n, error in pool.imap_unordered(_rebuild, jobs, chunksize=8):
+            report.images += 1
+            if error:
+                report.failed += 1
+                report.errors.append((source, error))
+                logging.warning('Could not create thumbnails of %s: %s' % (source, error))
+            else:
+                report.thumbnails += n
+            if report.images % 100 == 0:
+                logging.info(repr(report))
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    # the thumbnails were made by other processes, so our index does not know about these
+    get_thumbnail_index(images_cache_local).refresh()
+    report.orphans = remove_orphaned_content(images_cache_local)
+    if report.orphans:
+        logging.info('removed %s unused files from the content directory' % report.orphans)
+    return report
+
+
+def main(argv):
+    parser = optparse.OptionParser(usage='%prog IMAGES_CACHE_LOCAL [--all] [--processes N]')
+    parser.add_option('--all', action='store_true', dest='force', default=False, help='regenerate all thumbnails')
+    parser.add_option('--processes', type='int', default=None, help='the number of processes (default: the number of CPUs)')
+    options, args = parser.parse_args(argv)
+    if len(args) != 1:
+        parser.error('give the path of the image cache')
+    logging.basicConfig(level=logging.INFO)
+    report = rebuild_thumbnails(args[0], processes=options.processes, force=options.force)
+    print report
+    for filename, error in report.errors:
+        print '%s: %s' % (filename, error)
+    return report.failed and 1 or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -35,6 +35,7 @@ def identify_doubles(doubles=doubles, repo=repo):
     total = len(doubles)
     i = 0
 #    doubles = doubles[:10]
+    pairs = []
     for ls in doubles:
         #find the biography for each item in the list
         i += 1
@@ -46,8 +47,9 @@ def identify_doubles(doubles=doubles, repo=repo):
         #identify the persons
         p1 = persons[0]
         for p2 in persons[1:]:
-            print 'identifying', p1, p2
-            repo.identify(p1, p2)
+            pairs.append((p1, p2))
+    print 'identifying', len(pairs), 'pairs'
+    repo.identify_batch(pairs)
 
 def doubles_in_suggestions_list(doubles=doubles, repo=repo):
     doubles = doubles.values()